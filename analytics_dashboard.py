@@ -1,13 +1,27 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from datetime import date
-from itertools import combinations
+import pyarrow as pa
+from scipy import sparse
+
+from convert_to_columnar import (
+    ITEMS_SCHEMA, ORDERS_SCHEMA, read_csv_tail, read_table, source_path,
+)
 # -----------------------------------------------------------
 # PORTFOLIO MODE (Anonymizes sensitive business data)
 # -----------------------------------------------------------
 
+# Labels are tracked by a keyed hash of each name, so portfolio mode needs a
+# secret in the DASHBOARD_ANON_KEY environment variable (any private string,
+# kept stable across restarts); the app stops with an error without it.
+# Set PORTFOLIO_MODE = False to show the real names and values instead.
 PORTFOLIO_MODE = True
 
 # -----------------------------------------------------------
@@ -291,111 +305,122 @@ st.caption(
 )
 
 
-def format_number_columns(df):
-    df2 = df.copy()
-    for col in df2.select_dtypes(include=[np.number]).columns:
-        df2[col] = df2[col].apply(lambda x: f"{x:,}")
-    return df2
+# Display formats for numeric table columns. Frames stay numeric and
+# Streamlit formats the cells client-side, so columns still sort as numbers.
+NUMBER_FORMATS = {
+    "count": "%,d",
+    "number": "localized",
+    "dollars": "$%,.0f",
+    "percent": "%.1f%%",  # values already in percent (0-100)
+    "percent_2": "%.2f%%",
+    "ratio": "%.2f×",
+}
 
 
-# -----------------------------------------------------------
-# LOAD DATA
-# -----------------------------------------------------------
+def number_columns(formats):
+    """st.dataframe column_config from {column label: NUMBER_FORMATS key}."""
+    return {
+        col: st.column_config.NumberColumn(format=NUMBER_FORMATS[kind])
+        for col, kind in formats.items()
+    }
 
-df = pd.read_csv("orders_clean.csv")
-items = pd.read_csv("items_clean.csv")
 
 # -----------------------------------------------------------
 # HARD ANONYMIZATION MAPS (NON-REVERSIBLE)
 # -----------------------------------------------------------
 
 
+# Secret key of the hash that identifies names in the ingest state.
+# Required in portfolio mode: without it, the stored digests could be
+# recomputed from candidate names.
+ANON_KEY = os.environ.get("DASHBOARD_ANON_KEY", "").encode()[:64]
 
-def anonymize_series(series, prefix):
-    unique_vals = series.dropna().unique()
-    mapping = {v: f"{prefix} {i+1}" for i, v in enumerate(unique_vals)}
-    return series.map(mapping), mapping
 
-if PORTFOLIO_MODE:
-    items["product_name"], PRODUCT_MAP = anonymize_series(
-        items["product_name"], "Product"
-    )
+def anon_digest(value):
+    """Keyed hash of a name: recognizes it in later batches without storing it."""
+    return hashlib.blake2b(str(value).encode(), key=ANON_KEY, digest_size=16).digest()
 
-    items["vendor_name"], VENDOR_MAP = anonymize_series(
-        items["vendor_name"], "Vendor"
-    )
 
-    # Optional but recommended
-    items["category"], CATEGORY_MAP = anonymize_series(
-        items["category"], "Category"
-    )
+def anonymize_series(series, prefix, labels):
+    """
+    Replace values with "<prefix> N" labels, hashing each distinct value once
+    and broadcasting by factorize codes. `labels` maps the digest of every
+    value seen so far to its label; new values are numbered after them in
+    order of first appearance, so an appended batch continues the numbering
+    a full load of the whole file produces.
+    """
+    codes, uniques = pd.factorize(series)
+    names = []
+    for v in uniques:
+        digest = anon_digest(v)
+        if digest not in labels:
+            labels[digest] = f"{prefix} {len(labels) + 1}"
+        names.append(labels[digest])
+    return pd.Series(pd.Categorical.from_codes(codes, names), index=series.index)
 
-def synthetic_rank_values(series, low=1000, high=50000):
-    ranks = series.rank(method="dense")
-    scaled = np.interp(ranks, (ranks.min(), ranks.max()), (low, high))
-    noise = np.random.uniform(0.85, 1.15, size=len(series))
-    return (scaled * noise).round()
 
+# Seed of the synthetic values; change it to re-draw every masked value.
+# Noise and scale are keyed by ANON_KEY as well, so the masking cannot be
+# inverted from this source alone.
+SYNTHETIC_SEED = 20240101
 
-# -----------------------------------------------------------
-# APPLY SYNTHETIC (NON-REVERSIBLE) VALUES FOR PORTFOLIO MODE
-# -----------------------------------------------------------
 
-if PORTFOLIO_MODE:
-    # Orders table
-    if "total" in df.columns:
-        df["total"] = synthetic_rank_values(df["total"], low=20, high=200)
+def synthetic_secret(salt, size=8):
+    """Bytes derived from ANON_KEY, SYNTHETIC_SEED and `salt`."""
+    return hashlib.blake2b(f"{SYNTHETIC_SEED}:{salt}".encode(), key=ANON_KEY, digest_size=size).digest()
 
-    # Items table
-    if "net_sales" in items.columns:
-        items["net_sales"] = synthetic_rank_values(items["net_sales"], low=50, high=1500)
 
-    if "total_inventory_sold" in items.columns:
-        items["total_inventory_sold"] = synthetic_rank_values(
-            items["total_inventory_sold"], low=1, high=40
-        )
+def synthetic_noise(keys, salt, low=0.85, high=1.15):
+    """
+    Uniform noise in [low, high) per row, a pure function of the row's
+    `keys`, `salt` and the synthetic secret. A row gets the same value on
+    every load, in every process and whichever batch it arrives in.
+    """
+    hash_key = synthetic_secret(f"noise:{salt}").hex()
+    hashes = pd.util.hash_pandas_object(keys, index=False, hash_key=hash_key).to_numpy()
+    return low + (high - low) * ((hashes >> np.uint64(11)) / 2.0 ** 53)
+
 
+def synthetic_rank_values(series, low=1000, high=50000, pivot=1.0, keys=None):
+    """
+    Rank-preserving synthetic values on a fixed scale: a raw value v maps to
+    low + (high - low) * v**s / (v**s + p**s), so a row's value never depends
+    on which other rows were loaded with it. The shape s (0.5-1.5) and the
+    pivot p (within 2x of `pivot`) are secret per column. The noise is
+    seeded by `keys` (row identity, default the values themselves).
+    """
+    shape, spread = np.frombuffer(synthetic_secret(f"scale:{series.name}", 16), dtype="<u8")
+    shape = 0.5 + shape / 2.0 ** 64
+    pivot = (pivot * 2.0 ** (2 * (spread / 2.0 ** 64) - 1)) ** shape
+    raw = series.to_numpy(dtype=float).clip(0) ** shape
+    scaled = low + (high - low) * raw / (raw + pivot)
+    noise = synthetic_noise(series if keys is None else keys, series.name)
+    return (scaled * noise).round()
 
-# Fix missing or blank vendor names (Capeway Cannabis merch)
-items["vendor_name"] = items["vendor_name"].fillna("").astype(str)
 
-items.loc[
-    items["vendor_name"].str.strip() == "",
-    "vendor_name"
-] = "Capeway Cannabis"
+def mask_synthetic(frame, col, low, high, pivot):
+    if col in frame.columns:
+        raw = frame[col]
+        keys = pd.DataFrame({"order_id": frame["order_id"], col: raw})
+        frame[col] = synthetic_rank_values(raw, low, high, pivot, keys).astype(raw.dtype)
 
-# Fix mis-tagged RAW / smoking accessories showing as Capeway Cannabis
-mask_wrong_capeway = (
-    items["vendor_name"].eq("Capeway Cannabis")
-    & items["product_name"].str.contains(
-        "Raw|Rolling|Tray|Chillum|Paper|Cone|Banger|High Hemp|OCB",
-        case=False, na=False
-    )
-)
 
-items.loc[mask_wrong_capeway, "vendor_name"] = "BMB Wholesale"
+def day_number(timestamps):
+    """Calendar day as int32 days since 1970-01-01 (vectorized, unlike .dt.date)."""
+    return timestamps.to_numpy().astype("datetime64[D]").astype(np.int32)
 
-items["product_name"] = (
-    items["product_name"]
-        .str.replace("���", '"', regex=False)
-        .str.replace("�", "", regex=False)  # generic cleanup
-)
 
+def to_day(d):
+    """datetime.date -> day number (for widget values at the filter boundary)."""
+    return int(np.datetime64(d, "D").astype(np.int64))
 
-# Convert any Green Gruff product into a clearer unique category
-items.loc[items["vendor_name"].str.contains("Green Gruff", case=False, na=False), "category"] = "Dog Treats"
 
-df["order_timestamp"] = pd.to_datetime(df["order_timestamp"])
-items["order_timestamp"] = pd.to_datetime(items["order_timestamp"])
+def day_to_date(days):
+    """Day numbers -> datetime64[D] (scalar .item() gives a datetime.date)."""
+    return np.asarray(days, dtype=np.int64).astype("datetime64[D]")
 
-df["date"] = df["order_timestamp"].dt.date
-items["date"] = items["order_timestamp"].dt.date
-df["hour"] = df["order_timestamp"].dt.hour
-df["weekday"] = df["order_timestamp"].dt.day_name()
 
-# Normalize customer hash key between orders/items for potential joins
-if "customer_id_hash" in items.columns and "customer_hash_id" not in items.columns:
-    items["customer_hash_id"] = items["customer_id_hash"]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
 
 # Normalize categories in BOTH tables
 category_fix_map = {
@@ -408,538 +433,2176 @@ category_fix_map = {
     "Joint": "Joints",  # <-- 🔥 the one you want
 }
 
-items["category"] = items["category"].replace(category_fix_map)
-df["category"] = df.get("category", pd.Series(index=df.index)).replace(category_fix_map)
+# Item label columns cleaned by the rules below
+ITEM_LABELS = ("vendor_name", "product_name", "category")
+
+ACCESSORY_PATTERN = "Raw|Rolling|Tray|Chillum|Paper|Cone|Banger|High Hemp|OCB"
+
+# Cleaning rules, applied in order to every distinct (vendor, product,
+# category) combination: (action, column, argument, conditions), where each
+# condition is (column, test, value) and all of them must hold.
+CLEANING_RULES = [
+    # Fix missing or blank vendor names (Capeway Cannabis merch)
+    ("text", "vendor_name", "", []),
+    ("set", "vendor_name", "Capeway Cannabis", [("vendor_name", "blank", None)]),
+    # Fix mis-tagged RAW / smoking accessories showing as Capeway Cannabis
+    ("set", "vendor_name", "BMB Wholesale", [
+        ("vendor_name", "equals", "Capeway Cannabis"),
+        ("product_name", "contains", ACCESSORY_PATTERN),
+    ]),
+    # Mojibake in product names
+    ("replace", "product_name", ("���", '"'), []),
+    ("replace", "product_name", ("�", ""), []),  # generic cleanup
+    # Convert any Green Gruff product into a clearer unique category
+    ("set", "category", "Dog Treats", [("vendor_name", "contains", "Green Gruff")]),
+    ("map", "category", category_fix_map, []),
+]
+
+RULE_TESTS = {
+    "blank": lambda s, _: s.str.strip() == "",
+    "equals": lambda s, value: s.eq(value),
+    "contains": lambda s, pattern: s.str.contains(pattern, case=False, na=False),
+}
 
+RULE_ACTIONS = {
+    "text": lambda s, fill: s.fillna(fill).astype(str),
+    "set": lambda s, value: pd.Series(value, index=s.index, dtype=object),
+    "replace": lambda s, old_new: s.str.replace(*old_new, regex=False),
+    "map": lambda s, mapping: s.replace(mapping),
+}
 
-# ---------------------------
-#   CATEGORY FILTER (FINAL)
-# ---------------------------
 
-st.sidebar.header("Filters")
+def apply_cleaning_rules(combos, rules=CLEANING_RULES):
+    """Apply `rules` in order to a frame of distinct label combinations, in place."""
+    for action, col, argument, conditions in rules:
+        match = pd.Series(True, index=combos.index)
+        for test_col, test, value in conditions:
+            match &= RULE_TESTS[test](combos[test_col], value)
+        if match.any():
+            updated = RULE_ACTIONS[action](combos.loc[match, col], argument)
+            combos[col] = combos[col].astype(object)
+            combos.loc[match, col] = updated
 
 
-min_date = df["date"].min()
-max_date = df["date"].max()
+def distinct_combinations(frame, cols):
+    """
+    Distinct value combinations of `cols` (missing values included) and the
+    combination code of every row, from per-column factorize codes.
+    """
+    key = np.zeros(len(frame), dtype=np.int64)
+    for col in cols:
+        codes, values = pd.factorize(frame[col])
+        key = key * (len(values) + 1) + codes + 1
+    combo_codes, keys = pd.factorize(key)
+    rows = np.zeros(len(keys), dtype=np.int64)
+    rows[combo_codes] = np.arange(len(key))  # any row of each combination
+    combos = frame[list(cols)].iloc[rows].reset_index(drop=True).astype(object)
+    return combos, combo_codes
 
-# Date range
-date_range = st.sidebar.date_input(
-    "Date Range",
-    value=(min_date, max_date),
-    key="date_range"
-)
-if isinstance(date_range, (list, tuple)):
-    start_date, end_date = date_range
-else:
-    start_date = end_date = date_range
 
-# Order minimum
-order_min_filter = st.sidebar.slider(
-    "Minimum Order Total ($)",
-    min_value=0.0,
-    max_value=float(round(df["total"].max(), 0)),
-    value=0.0,
-    step=1.0,
-    key="order_min"
-)
+# -----------------------------------------------------------
+# LOAD DATA (cached pipeline stage, one copy per data version)
+# -----------------------------------------------------------
 
-# All categories
-all_categories = sorted(items["category"].dropna().unique().tolist())
+# Source format: "csv", "parquet" or "arrow" (build the typed columnar files
+# with `python convert_to_columnar.py --format parquet|arrow`)
+DATA_FORMAT = "csv"
 
-# Initialize state
-if "selected_categories" not in st.session_state:
-    st.session_state.selected_categories = all_categories.copy()
+# Parse only rows appended to the CSV exports since the last refresh
+INCREMENTAL_INGEST = True
 
-# Reset button
-if st.sidebar.button("Reset Categories"):
-    st.session_state._reset_categories_flag = True
-    st.rerun()
+ORDERS_PATH = source_path("orders_clean", DATA_FORMAT)
+ITEMS_PATH = source_path("items_clean", DATA_FORMAT)
 
-# Handle reset before multiselect draws
-if st.session_state.get("_reset_categories_flag", False):
-    default_categories = all_categories.copy()
-    st.session_state.selected_categories = default_categories
-    st.session_state._reset_categories_flag = False
-else:
-    default_categories = st.session_state.selected_categories
 
-# Safe multiselect
-selected_categories = st.sidebar.multiselect(
-    "Product Categories",
-    options=all_categories,
-    key="selected_categories"
-)
+def source_fingerprint(*paths):
+    """
+    Cheap version key for the source files: (path, size, mtime) per file.
+    Any rewrite or append changes it, so the cached frames are refreshed.
+    """
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
 
 
-st.sidebar.markdown("---")
-st.sidebar.caption("Filters apply across all tabs.")
+def source_anchor(path, offset, size=4096):
+    """Hash of the bytes just before `offset`, to tell an append from a rewrite."""
+    with open(path, "rb") as f:
+        f.seek(max(offset - size, 0))
+        return hashlib.sha1(f.read(min(offset, size))).hexdigest()
 
-# ---------------------------
-# APPLY FILTERS
-# ---------------------------
 
-# If nothing selected → empty frames
-if len(st.session_state.selected_categories) == 0:
-    df_filtered = df.iloc[0:0]
-    items_filtered = items.iloc[0:0]
+def clean_frames(df, items, state):
+    """
+    Anonymize and clean one batch of rows in place. `state` carries the
+    label of every name seen in earlier batches (by keyed digest, never the
+    name), so an appended batch gets the same labels as the history.
+    """
+    if PORTFOLIO_MODE:
+        labels = state.setdefault("labels", {})
+        items["product_name"] = anonymize_series(
+            items["product_name"], "Product", labels.setdefault("product_name", {})
+        )
+        items["vendor_name"] = anonymize_series(
+            items["vendor_name"], "Vendor", labels.setdefault("vendor_name", {})
+        )
 
-else:
-    # Filter items table
-    items_filtered = items[
-        (items["date"] >= start_date)
-        & (items["date"] <= end_date)
-        & (items["category"].isin(st.session_state.selected_categories))
-    ]
+        # Optional but recommended
+        items["category"] = anonymize_series(
+            items["category"], "Category", labels.setdefault("category", {})
+        )
 
-    # Only include orders that appear in filtered items
-    valid_orders = items_filtered["order_id"].unique()
+    # Clean the distinct (vendor, product, category) combinations with the
+    # rule table, then broadcast back to rows as dictionary-encoded labels,
+    # so filters and groupbys run on integer codes
+    combos, combo_codes = distinct_combinations(items, ITEM_LABELS)
+    apply_cleaning_rules(combos)
+    for col in ITEM_LABELS:
+        codes, labels = pd.factorize(combos[col], sort=True)
+        items[col] = pd.Categorical.from_codes(codes[combo_codes], labels)
 
-    df_filtered = df[
-        (df["date"] >= start_date)
-        & (df["date"] <= end_date)
-        & (df["total"] >= order_min_filter)
-        & (df["order_id"].isin(valid_orders))
-    ]
+    # The orders table's cleanup works on plain strings, so dictionary-typed
+    # columns from the typed readers are decoded first
+    for col in df.select_dtypes("category").columns:
+        df[col] = df[col].astype(object)
 
+    # -----------------------------------------------------------
+    # APPLY SYNTHETIC (NON-REVERSIBLE) VALUES FOR PORTFOLIO MODE
+    # -----------------------------------------------------------
 
-# -----------------------------------------------------------
-# KPI CARDS
-# -----------------------------------------------------------
+    if PORTFOLIO_MODE:
+        # The last argument is a typical raw value, placed mid-range
 
-total_revenue = df_filtered["total"].sum()
-avg_order = df_filtered["total"].mean() if len(df_filtered) else 0
-unique_customers = (
-    df_filtered["customer_hash_id"].nunique() if len(df_filtered) else 0
-)
+        # Orders table
+        mask_synthetic(df, "total", 20, 200, 50)
 
+        # Items table
+        mask_synthetic(items, "net_sales", 50, 1500, 25)
+        mask_synthetic(items, "total_inventory_sold", 1, 40, 2)
 
+    df["order_timestamp"] = pd.to_datetime(df["order_timestamp"])
+    items["order_timestamp"] = pd.to_datetime(items["order_timestamp"])
 
-# Avg items/order (based on items table)
-if len(df_filtered) and len(items_filtered):
-    total_items = items_filtered["total_inventory_sold"].sum()
-    n_orders = df_filtered["order_id"].nunique()
-    avg_items_order = total_items / n_orders if n_orders else 0
-else:
-    avg_items_order = 0
+    df["day"] = day_number(df["order_timestamp"])
+    items["day"] = day_number(items["order_timestamp"])
+    df["hour"] = df["order_timestamp"].dt.hour
+    df["weekday"] = df["order_timestamp"].dt.day_name()
 
-# Repeat customer rate
-if len(df_filtered):
-    df_date_range = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-    visits_series = df_date_range.groupby("customer_hash_id")["order_id"].nunique()
-    repeat_rate = (visits_series > 1).mean() * 100
-else:
-    repeat_rate = 0.0
+    df["category"] = df.get("category", pd.Series(index=df.index)).replace(category_fix_map)
 
+    df["weekday"] = pd.Categorical(df["weekday"], categories=WEEKDAYS, ordered=True)
 
-st.markdown("<br>", unsafe_allow_html=True)
-kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+    # Keep both tables in time order so date windows are searchsorted slices
+    sort_by_time(df)
+    sort_by_time(items)
 
 
-def kpi_box(title, value, subtitle=None):
-    st.markdown(
-        f"""
-    <div style="
-        background-color:#ffffff;
-        border-radius:12px;
-        padding:18px 20px;
-        border-left:6px solid {PRIMARY_EMERALD};
-        box-shadow:0 1px 4px rgba(0,0,0,0.15);
-        height:100%;
-    ">
-        <h4 style="margin:0 0 4px 0; color:{KPI_TITLE}; font-size:15px;">{title}</h4>
-        <h2 style="margin:0; color:{PRIMARY_EMERALD}; font-size:24px;">{value}</h2>
-        {"<p style='margin:6px 0 0 0; color:#666; font-size:12px;'>" + subtitle + "</p>" if subtitle else ""}
-    </div>
-    """,
-        unsafe_allow_html=True,
-    )
+def sort_by_time(frame):
+    """Stable in-place sort by order_timestamp (no-op when already sorted)."""
+    if not frame["order_timestamp"].is_monotonic_increasing:
+        frame.sort_values("order_timestamp", kind="stable", inplace=True)
+        frame.reset_index(drop=True, inplace=True)
+    return frame
 
 
-with kpi1:
-    kpi_box("Total Revenue", f"${total_revenue:,.2f}", "Across selected date range")
-with kpi2:
-    kpi_box("Average Order Value", f"${avg_order:,.2f}", "Per completed order")
-with kpi3:
-    kpi_box("Unique Customers", f"{unique_customers:,}", "Distinct customers served")
-with kpi4:
-    kpi_box(
-        "Repeat Customer Rate",
-        f"{repeat_rate:.1f}%",
-        "Share of customers with 2+ visits",
-    )
+def day_window(frame, start_day, end_day):
+    """
+    Rows with start_day <= day <= end_day of a time-sorted table, found by
+    binary search: an O(log n) positional slice (a view, not a copy).
+    """
+    lo, hi = np.searchsorted(frame["day"].to_numpy(), [start_day, end_day + 1])
+    return frame.iloc[lo:hi]
 
-# Little “snapshot” line under KPIs
-total_orders_selected = df_filtered["order_id"].nunique()
-total_items_selected = (
-    items_filtered["total_inventory_sold"].sum() if len(items_filtered) else 0
-)
 
+def load_clean_data(orders_path, items_path):
+    """
+    Read, anonymize and clean both tables (the expensive part of a cold
+    start). Also returns the ingest state needed to append later rows.
+    """
+    state = {"offsets": {}, "anchors": {}}
 
-st.markdown(
-    f"""
-    <div style="margin-top:8px; margin-bottom:10px;">
-        <span class="snapshot-pill">📅 {start_date} → {end_date}</span>
-        <span class="snapshot-pill">🧾 {total_orders_selected:,} orders</span>
-        <span class="snapshot-pill">🧺 {total_items_selected:,} items</span>
-        <span class="snapshot-pill">🏷️ {len(selected_categories)} categories</span>
-    </div>
-    """,
-    unsafe_allow_html=True,
-)
+    if DATA_FORMAT == "csv":
+        df, state["offsets"][orders_path] = read_csv_tail(orders_path, ORDERS_SCHEMA)
+        items, state["offsets"][items_path] = read_csv_tail(items_path, ITEMS_SCHEMA)
+        for path, offset in state["offsets"].items():
+            state["anchors"][path] = source_anchor(path, offset)
+    else:
+        df = read_table(orders_path, ORDERS_SCHEMA)
+        items = read_table(items_path, ITEMS_SCHEMA)
 
-st.markdown("---")
+    clean_frames(df, items, state)
+    return df, items, state
 
 
 # -----------------------------------------------------------
-# SECTION WRAPPER HELPERS
+# SHARED SNAPSHOT (memory-mapped Arrow, one per data version per host)
 # -----------------------------------------------------------
 
+# Local disk only: every dashboard process on the host maps the same files
+SNAPSHOT_DIR = ".dashboard_snapshot"
 
-def card_start():
-    st.markdown("<div class='section-card'>", unsafe_allow_html=True)
+# Snapshots of other data versions are removed once they are this old, so a
+# process that found one just before a newer version was built can still
+# map it
+SNAPSHOT_MAX_AGE = 15 * 60  # seconds
 
 
-def card_end():
-    st.markdown("</div>", unsafe_allow_html=True)
+def snapshot_paths(fingerprint):
+    """
+    Snapshot files for one data version. The key also covers this script's
+    source and the anonymization key (as a keyed digest, never the key), so
+    a change to the cleaning code or a rotated key never maps a stale
+    snapshot.
+    """
+    with open(__file__, "rb") as f:
+        code_hash = hashlib.sha1(f.read()).hexdigest()
+    key = hashlib.sha1(
+        repr((fingerprint, PORTFOLIO_MODE, anon_digest(""), code_hash)).encode()
+    ).hexdigest()[:16]
+    return (
+        os.path.join(SNAPSHOT_DIR, f"{key}-orders.arrow"),
+        os.path.join(SNAPSHOT_DIR, f"{key}-items.arrow"),
+        os.path.join(SNAPSHOT_DIR, f"{key}-state.pkl"),
+    )
 
 
-# -----------------------------------------------------------
-# HELPER: compute category pairings (auto-generated bundling)
-# -----------------------------------------------------------
+def write_snapshot(frame, path):
+    """Write an uncompressed Arrow IPC file atomically (tmp file + rename)."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
 
 
-@st.cache_data
-def compute_category_pairs(items_df: pd.DataFrame) -> pd.DataFrame:
+def map_snapshot(path):
     """
-    Build category-level pairings based on items in the same order.
-    Returns: DataFrame[category_a, category_b, pair_count]
+    Memory-map a snapshot. Numeric, datetime and categorical columns come
+    back as read-only zero-copy views of the page cache, shared by every
+    process that maps the same file.
     """
-    if items_df.empty:
-        return pd.DataFrame(columns=["category_a", "category_b", "pair_count"])
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return table.to_pandas(split_blocks=True)
 
-    pairs_list = []
-    order_cats = (
-        items_df.dropna(subset=["category"])
-        .groupby("order_id")["category"]
-        .apply(lambda x: sorted(set(x)))
-    )
 
-    for cats in order_cats:
-        if len(cats) < 2:
+def remove_stale_snapshots(keep):
+    """
+    Delete snapshot files of other data versions older than
+    SNAPSHOT_MAX_AGE. Other writers' in-flight *.tmp files are never
+    touched.
+    """
+    now = time.time()
+    for name in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        if path in keep or name.endswith(".tmp"):
             continue
-        for a, b in combinations(cats, 2):
-            pairs_list.append((a, b))
+        try:
+            if now - os.path.getmtime(path) > SNAPSHOT_MAX_AGE:
+                os.remove(path)  # processes still mapping it keep their pages
+        except OSError:
+            pass
 
-    if not pairs_list:
-        return pd.DataFrame(columns=["category_a", "category_b", "pair_count"])
 
-    pair_df = pd.DataFrame(pairs_list, columns=["category_a", "category_b"])
-    pair_counts = (
-        pair_df.value_counts()
-        .reset_index(name="pair_count")
-        .sort_values("pair_count", ascending=False)
-    )
-    return pair_counts
+def build_snapshot(orders_path, items_path, paths):
+    """Read and clean both tables once and write them as the snapshot `paths`."""
+    write_snapshot_version(*load_clean_data(orders_path, items_path), paths)
 
 
-# -----------------------------------------------------------
-# HELPER: profitability enrichment
-# -----------------------------------------------------------
+def write_snapshot_version(df, items, state, paths):
+    """Write one data version's frames and ingest state as the snapshot `paths`."""
+    orders_snap, items_snap, state_snap = paths
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_snapshot(df, orders_snap)
+    write_snapshot(items, items_snap)
+    # Written last: its presence marks the snapshot as complete
+    tmp_path = f"{state_snap}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, state_snap)
+    remove_stale_snapshots(keep=paths)
 
-def enrich_with_profit(items_df: pd.DataFrame) -> pd.DataFrame:
+
+def read_snapshot(paths):
+    orders_snap, items_snap, state_snap = paths
+    with open(state_snap, "rb") as f:
+        state = pickle.load(f)
+    return map_snapshot(orders_snap), map_snapshot(items_snap), state
+
+
+def load_shared_data(orders_path, items_path, fingerprint):
     """
-    Adds estimated margin %, profit and cost to item-level data.
-    Margins are rough category-based estimates for stakeholder visibility.
+    Cleaned frames (plus ingest state) for one data version, mapped from the
+    on-disk snapshot. The first process to see a new version builds the
+    snapshot; every other process and session maps it instead of holding a
+    private copy.
     """
-    if items_df.empty:
-        return items_df.copy()
-
-    margin_map = {
-        # core categories
-        "Flower": 0.45,
-        "Edibles": 0.50,
-        "Joint": 0.55,
-        "Joints": 0.55,
-        "Preroll Packs": 0.55,
-        "Pre-Rolls": 0.55,
-        "Prerolls": 0.55,
-        "Disposables": 0.48,
-        "Cartridges": 0.48,
-        "Concentrates": 0.52,
-        "Beverages": 0.40,
-        "Accessories": 0.60,
-    }
-
-    out = items_df.copy()
-    out["margin_pct"] = out["category"].map(margin_map).fillna(0.50)
-    out["est_gross_profit"] = out["net_sales"] * out["margin_pct"]
-    out["est_cost"] = out["net_sales"] - out["est_gross_profit"]
-    return out
+    paths = snapshot_paths(fingerprint)
+    if not os.path.exists(paths[2]):
+        build_snapshot(orders_path, items_path, paths)
+    try:
+        return read_snapshot(paths)
+    except FileNotFoundError:
+        # Removed as stale by another process in between: build it again
+        build_snapshot(orders_path, items_path, paths)
+        return read_snapshot(paths)
 
 
 # -----------------------------------------------------------
-# TABS
+# INCREMENTAL REFRESH (per process, shared by its sessions)
 # -----------------------------------------------------------
 
-tab_overview, tab_products, tab_bundles, tab_customers, tab_time, tab_profit, tab_insights = st.tabs(
-    [
-        "📍 Overview",
-        "🧺 Products",
-        "🔗 Bundles & Pairings",
-        "👥 Customers",
-        "⏱ Time & Patterns",
-        "💵 Profitability",
-        "💡 Insights",
-    ]
-)
 
+@st.cache_resource
+def get_data_store(orders_path, items_path):
+    """Current data version, its fingerprint and ingest state for this process."""
+    return {"lock": threading.Lock(), "fingerprint": None}
 
-# -----------------------------------------------------------
-# TAB 1 — OVERVIEW
-# -----------------------------------------------------------
 
-with tab_overview:
+def new_data_version(orders, items, aggregates=None):
+    """
+    One immutable data version: the frames plus the derived aggregates built
+    from them. A refresh swaps in a new version, so a rerun that already
+    holds one keeps a consistent view of frames and aggregates.
+    """
+    return {
+        "orders": orders,
+        "items": items,
+        "aggregates": aggregates or {},
+        "lock": threading.Lock(),
+    }
+
 
-    # Executive summary
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>🧾 Executive Summary</h3>",
-        unsafe_allow_html=True,
+def append_rows(frame, new_rows):
+    """
+    Concatenate a batch onto a table, keeping categorical columns categorical
+    (new labels are added after the existing ones, so old codes stay valid).
+    Builds a new frame; the one sessions may still be reading is untouched.
+    """
+    recoded, recoded_new = {}, {}
+    for col in frame.select_dtypes("category").columns:
+        if col in new_rows.columns:
+            categories = frame[col].cat.categories.union(
+                new_rows[col].cat.categories, sort=False
+            )
+            recoded[col] = frame[col].cat.set_categories(categories)
+            recoded_new[col] = new_rows[col].cat.set_categories(categories)
+    combined = pd.concat(
+        [frame.assign(**recoded), new_rows.assign(**recoded_new)], ignore_index=True
     )
+    # Late-arriving rows (older than the current tail) need a re-sort
+    return sort_by_time(combined)
 
-    if len(df_filtered) and len(items_filtered):
-        total_orders = df_filtered["order_id"].nunique()
 
+def append_new_rows(store, orders_path, items_path, fingerprint):
+    """
+    Parse and clean only the rows appended to the CSVs since the last
+    refresh, then add them to the tables. The appended version becomes the
+    snapshot of `fingerprint` (or maps the one another process already
+    wrote), so the frames stay shared instead of a private concatenated
+    copy per process. Returns False when a file was rewritten rather than
+    appended to (caller does a full reload).
+    """
+    state = store["state"]
+    paths = (orders_path, items_path)
+    for path in paths:
+        offset = state["offsets"].get(path)
+        if offset is None or os.path.getsize(path) < offset:
+            return False
+        if source_anchor(path, offset) != state["anchors"][path]:
+            return False
+
+    new_df, orders_end = read_csv_tail(orders_path, ORDERS_SCHEMA, state["offsets"][orders_path])
+    new_items, items_end = read_csv_tail(items_path, ITEMS_SCHEMA, state["offsets"][items_path])
+
+    if len(new_df) or len(new_items):
+        clean_frames(new_df, new_items, state)
+
+    state["offsets"].update({orders_path: orders_end, items_path: items_end})
+    for path in paths:
+        state["anchors"][path] = source_anchor(path, state["offsets"][path])
+
+    if len(new_df) or len(new_items):
+        old = store["data"]
+        orders = append_rows(old["orders"], new_df)
+        items = append_rows(old["items"], new_items)
+        snapshot = snapshot_paths(fingerprint)
+        try:
+            if not os.path.exists(snapshot[2]):
+                write_snapshot_version(orders, items, state, snapshot)
+            orders, items, _ = read_snapshot(snapshot)
+        except OSError:
+            pass  # keep the private frames for this version
+        store["data"] = new_data_version(
+            orders, items, append_aggregates(old, orders, items)
+        )
+    return True
 
-        # Category revenue
-        category_revenue = items_filtered.groupby("category")["net_sales"].sum()
-        if not category_revenue.empty:
-            top_category = "Category Segment A"
-            top_share = category_revenue.max() / category_revenue.sum() * 100
-        else:
-            top_category, top_share = "N/A", 0.0
 
-        # Category logic
-        if len(category_revenue) == 1:
-            category_sentence = (
-                f"All sales in the selected filters come from the <b>{top_category}</b> category."
-            )
-        else:
-            category_sentence = (
-                f"<b>{top_category}</b> is currently the leading category, "
-                f"accounting for <b>{top_share:.1f}%</b> of category-level revenue."
+def refresh_data(orders_path, items_path):
+    """
+    Bring this process's frames up to date with the source files: appended
+    CSV rows are ingested on their own, anything else maps the snapshot for
+    the new version. Returns the current data version; callers must treat
+    its frames as read-only (filter/copy, never assign into them).
+    """
+    store = get_data_store(orders_path, items_path)
+    fingerprint = source_fingerprint(orders_path, items_path)
+
+    with store["lock"]:
+        if store["fingerprint"] != fingerprint:
+            appended = (
+                INCREMENTAL_INGEST
+                and DATA_FORMAT == "csv"
+                and store["fingerprint"] is not None
+                and append_new_rows(store, orders_path, items_path, fingerprint)
             )
+            if not appended:
+                with st.spinner("Loading sales data..."):
+                    orders, items, store["state"] = load_shared_data(
+                        orders_path, items_path, fingerprint
+                    )
+                store["data"] = new_data_version(orders, items)
+            store["fingerprint"] = fingerprint
 
-        # Repeat rates
-        visits_filtered = df_filtered.groupby("customer_hash_id")["order_id"].nunique()
-        repeat_rate_filtered = (visits_filtered > 1).mean() * 100 if len(visits_filtered) else 0
+    return store["data"]
 
-        df_date_range = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-        visits_global = df_date_range.groupby("customer_hash_id")["order_id"].nunique()
-        repeat_rate_global = (visits_global > 1).mean() * 100 if len(visits_global) else 0
 
-        # 🔥 NEW LOGIC — ONLY SHOW COMPARISON IF USER SELECTED A SUBSET
-        all_selected = set(selected_categories) == set(all_categories)
+# -----------------------------------------------------------
+# DERIVED AGGREGATES (built once per data version, merged on append)
+# -----------------------------------------------------------
 
-        if all_selected:
-            repeat_sentence = (
-                f"Roughly <b>{repeat_rate_global:.1f}%</b> of customers are repeat buyers."
-            )
-        else:
-            repeat_sentence = (
-                f"Roughly <b>{repeat_rate_filtered:.1f}%</b> of customers who purchased within these filters "
-                f"are repeat buyers, while the overall repeat rate across all customers in this date range "
-                f"is <b>{repeat_rate_global:.1f}%</b>."
-            )
 
-        # Final summary
-        st.markdown(
-            f"""
-            <div style="max-width:1100px; line-height:1.6; font-size:15px;">
-                This view summarizes <b>{total_orders:,}</b> orders over the selected period. 
-                Customers spend an average of <b>${avg_order:,.2f}</b> per visit and purchase about 
-                <b>{avg_items_order:.2f}</b> items per basket. 
-                {repeat_sentence} {category_sentence}
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+def get_aggregate(data, name):
+    """Aggregate `name` for a data version, built on first use."""
+    aggregates = data["aggregates"]
+    if name not in aggregates:
+        with data["lock"]:
+            if name not in aggregates:
+                build, _ = AGGREGATES[name]
+                aggregates[name] = build(data["orders"], data["items"])
+    return aggregates[name]
 
-    else:
-        st.markdown(
-            "<p style='font-size:14px;'>Adjust filters to see executive KPIs and narrative summary.</p>",
-            unsafe_allow_html=True,
-        )
 
-    card_end()
+def append_aggregates(old, orders, items):
+    """
+    Carry the aggregates of `old` over to the appended tables. A merge step
+    gets every row of the orders the batch touches: their rows in the
+    appended tables, and their earlier rows (already folded into the
+    aggregate), so an order whose rows arrive in several batches is
+    recounted as a whole. Aggregates without a merge step, merges that
+    return None, and all of them if late rows forced a re-sort or the
+    category codes were renumbered (frames mapped from a snapshot another
+    process built with a full load), are rebuilt lazily on next use.
+    """
+    n_orders, n_items = len(old["orders"]), len(old["items"])
+    in_order = (
+        orders["order_timestamp"].iloc[:n_orders].equals(old["orders"]["order_timestamp"])
+        and items["order_timestamp"].iloc[:n_items].equals(old["items"]["order_timestamp"])
+        and extends_categories(old["orders"], orders)
+        and extends_categories(old["items"], items)
+    )
+    merged = {}
+    if not in_order:
+        return merged
+
+    touched = pd.unique(np.concatenate([
+        orders["order_id"].to_numpy()[n_orders:], items["order_id"].to_numpy()[n_items:]
+    ]))
+    earlier_orders = old["orders"]["order_id"].isin(touched).to_numpy()
+    earlier_items = old["items"]["order_id"].isin(touched).to_numpy()
+    parts = (
+        orders[np.concatenate([earlier_orders, np.ones(len(orders) - n_orders, dtype=bool)])],
+        items[np.concatenate([earlier_items, np.ones(len(items) - n_items, dtype=bool)])],
+        old["orders"][earlier_orders],
+        old["items"][earlier_items],
+    )
+    for name, agg in old["aggregates"].items():
+        _, merge = AGGREGATES[name]
+        if merge is not None:
+            result = merge(agg, *parts)
+            if result is not None:
+                merged[name] = result
+    return merged
+
+
+def extends_categories(old, new):
+    """True when every categorical column of `new` keeps the codes of `old` (labels only appended)."""
+    for col in old.select_dtypes("category").columns:
+        categories = old[col].cat.categories
+        if not isinstance(new[col].dtype, pd.CategoricalDtype):
+            return False
+        if not categories.equals(new[col].cat.categories[: len(categories)]):
+            return False
+    return True
+
+
+def category_codes(items):
+    """Integer category code per line item (-1 = missing) and the label list."""
+    return items["category"].cat.codes.to_numpy(), items["category"].cat.categories
+
+
+def _pad_to(array, n_days, n_cats):
+    """Zero-extend a (days x categories) array to a larger shape."""
+    out = np.zeros((n_days, n_cats), dtype=array.dtype)
+    out[: array.shape[0], : array.shape[1]] = array
+    return out
 
 
+# ---- Daily x category rollup of line items ----
 
+CUBE_MEASURES = ("net_sales", "units", "lines", "orders")
 
 
-    # Revenue Over Time
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>📅 Revenue Over Time</h3>",
-        unsafe_allow_html=True,
+def build_category_cube(orders, items):
+    """
+    Dense (day x category) sums of net_sales, units, line count and distinct
+    orders, with prefix sums over days. Any date window then costs one
+    subtraction per category, however many line items it spans. (Distinct
+    orders add up across days because an order belongs to a single day.)
+    """
+    codes, categories = category_codes(items)
+    day = items["day"].to_numpy()
+    first_day = int(day.min()) if len(day) else 0
+    n_days = int(day.max()) - first_day + 1 if len(day) else 0
+    n_cats = len(categories)
+
+    keep = codes >= 0
+    cell = (day[keep] - first_day).astype(np.int64) * n_cats + codes[keep]
+    size = n_days * n_cats
+
+    def per_cell(cells, weights=None):
+        return np.bincount(cells, weights, minlength=size).reshape(n_days, n_cats)
+
+    order_cells = (
+        pd.DataFrame({"cell": cell, "order_id": items["order_id"].to_numpy()[keep]})
+        .drop_duplicates()["cell"]
+        .to_numpy()
     )
+    daily = {
+        "net_sales": per_cell(cell, items["net_sales"].to_numpy()[keep]),
+        "units": per_cell(cell, items["total_inventory_sold"].to_numpy()[keep]),
+        "lines": per_cell(cell),
+        "orders": per_cell(order_cells),
+    }
+    return _finish_cube(first_day, categories, daily)
 
-    if len(df_filtered):
-        daily_revenue = (
-            df_filtered.groupby("date")["total"].sum().reset_index()
-        )
 
-        fig = px.line(
-            daily_revenue,
-            x="date",
-            y="total",
-            title="Daily Revenue Trend",
-            labels={"date": "Date", "total": "Revenue ($)"},
-        )
+def _finish_cube(first_day, categories, daily):
+    prefix = {}
+    for name, values in daily.items():
+        prefix[name] = np.vstack([np.zeros((1, values.shape[1])), values.cumsum(axis=0)])
+    return {"first_day": first_day, "categories": categories, "daily": daily, "prefix": prefix}
 
-        fig.update_traces(
-            line=dict(width=4, color=BRIGHT_MINT),
-            hovertemplate="<b>%{x|%b %d, %Y}</b><br>Revenue: $%{y:,.2f}<extra></extra>",
-        )
 
-        fig.update_xaxes(
-            showgrid=False,
-            showline=True,
-            linecolor=BRIGHT_MINT,
-            tickfont=dict(color=BRIGHT_MINT, size=11),
-            tickformat="%b %d",
-            showticklabels=True,
-        )
-        fig.update_yaxes(
-            showgrid=False,
-            showline=True,
-            linecolor=BRIGHT_MINT,
-            tickfont=dict(color=BRIGHT_MINT, size=11),
-        )
+def merge_category_cube(cube, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Fold the touched orders into an existing cube (days/categories may
+    grow): the cube of their current rows is added and the cube of their
+    earlier rows, already counted, is taken out again.
+    """
+    if not len(new_items):
+        return cube
+    parts = [(cube, 1), (build_category_cube(new_orders, new_items), 1)]
+    if len(earlier_items):
+        parts.append((build_category_cube(earlier_orders, earlier_items), -1))
+    parts = [(part, sign) for part, sign in parts if len(part["daily"]["lines"])]
+
+    first_day = min(part["first_day"] for part, _ in parts)
+    n_days = max(part["first_day"] + len(part["daily"]["lines"]) for part, _ in parts) - first_day
+    # Appended labels extend the old list, so the longest one covers all codes
+    categories = max((part["categories"] for part, _ in parts), key=len)
+    daily = {}
+    for name in CUBE_MEASURES:
+        total = np.zeros((n_days, len(categories)))
+        for part, sign in parts:
+            values = part["daily"][name]
+            start = part["first_day"] - first_day
+            total[start : start + len(values)] += sign * _pad_to(values, len(values), len(categories))
+        daily[name] = total
+    return _finish_cube(first_day, categories, daily)
+
+
+def cube_window(cube, start_day, end_day, selected_categories):
+    """
+    Per-category totals over [start_day, end_day] for the selected labels,
+    O(#categories). Categories without line items in the window are dropped,
+    matching a groupby over the filtered rows.
+    """
+    n_days = len(cube["daily"]["lines"])
+    lo = int(np.clip(start_day - cube["first_day"], 0, n_days))
+    hi = int(np.clip(end_day - cube["first_day"] + 1, lo, n_days))
+    out = pd.DataFrame({"category": cube["categories"], "code": np.arange(len(cube["categories"]))})
+    for name, prefix in cube["prefix"].items():
+        out[name] = prefix[hi] - prefix[lo]
+    out[["units", "lines", "orders"]] = out[["units", "lines", "orders"]].astype(np.int64)
+    out = out[out["category"].isin(selected_categories) & (out["lines"] > 0)]
+    return out.reset_index(drop=True)
 
-        # Disable ALL zoom / scroll / drag interactions
-        fig.update_xaxes(fixedrange=True)
-        fig.update_yaxes(fixedrange=True)
-        
-        fig.update_layout(
-            dragmode=False,
-            modebar=dict(
-                remove=[
-                    "zoom",
-                    "pan",
-                    "select",
-                    "lasso",
-                    "zoomIn",
-                    "zoomOut",
-                    "autoScale",
-                    "resetScale"
-                ]
-            )
-        )
-        
-        fig.update_layout(template=plotly_template, height=360)
 
-        fig = clean_axes(fig)
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
+# ---- Daily per-product totals ----
 
-    else:
-        st.info("No data for selected filters.")
-    card_end()
 
+PRODUCT_DAILY_COLUMNS = (
+    "day", "product", "vendor", "code", "net_sales", "net_sales_whole", "units", "lines",
+)
 
+
+def build_product_daily(orders, items):
+    """
+    Net sales, units and line counts per (day, product code, vendor code,
+    category code), sorted by day. A date window is a searchsorted slice and
+    per-product totals for any category selection are one bincount over it,
+    so large catalogs need neither string-keyed groupbys nor a dense
+    day x product array. net_sales_whole sums line sales rounded to whole
+    dollars, as the search table shows them.
+    """
+    products = items["product_name"].cat.codes.to_numpy()
+    codes, categories = category_codes(items)
+    keep = (products >= 0) & (codes >= 0)
+    net_sales = items["net_sales"].to_numpy()[keep]
+    rows = (
+        pd.DataFrame({
+            "day": items["day"].to_numpy()[keep],
+            "product": products[keep],
+            "vendor": items["vendor_name"].cat.codes.to_numpy()[keep],
+            "code": codes[keep],
+            "net_sales": net_sales,
+            "net_sales_whole": np.round(net_sales).astype(np.int64),
+            "units": items["total_inventory_sold"].to_numpy()[keep],
+        })
+        .groupby(["day", "product", "vendor", "code"], sort=True)
+        .agg(
+            net_sales=("net_sales", "sum"),
+            net_sales_whole=("net_sales_whole", "sum"),
+            units=("units", "sum"),
+            lines=("net_sales", "size"),
+        )
+        .reset_index()
+    )
+    daily = {col: rows[col].to_numpy() for col in PRODUCT_DAILY_COLUMNS}
+    daily["products"] = items["product_name"].cat.categories
+    daily["vendors"] = items["vendor_name"].cat.categories
+    daily["categories"] = categories
+    return daily
+
+
+def merge_product_daily(daily, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Append the per-product rows of the touched orders' lines, keeping the
+    day order. Their earlier lines are already counted, so those rows are
+    taken out again before the table is compacted.
+    """
+    if not len(new_items):
+        return daily
+    delta = build_product_daily(new_orders, new_items)
+    parts = [daily, delta]
+    if len(earlier_items):
+        earlier = build_product_daily(earlier_orders, earlier_items)
+        for col in ("net_sales", "net_sales_whole", "units", "lines"):
+            earlier[col] = -earlier[col]
+        parts.append(earlier)
+    order = np.argsort(np.concatenate([part["day"] for part in parts]), kind="stable")
+    merged = {
+        col: np.concatenate([part[col] for part in parts])[order]
+        for col in PRODUCT_DAILY_COLUMNS
+    }
+    if len(earlier_items):
+        rows = (
+            pd.DataFrame(merged)
+            .groupby(["day", "product", "vendor", "code"], sort=True)
+            .sum()
+            .reset_index()
+        )
+        rows = rows[rows["lines"] != 0]
+        merged = {col: rows[col].to_numpy() for col in PRODUCT_DAILY_COLUMNS}
+    # Appended labels extend the old lists
+    for labels in ("products", "vendors", "categories"):
+        merged[labels] = delta[labels]
+    return merged
+
+
+def product_window(daily, start_day, end_day, selected_codes, margins=None):
+    """
+    Per-product totals (arrays indexed by product code) over [start_day,
+    end_day] for lines in the selected category codes. With `margins`
+    (indexed by category code) an estimated profit total is added.
+    """
+    lo, hi = np.searchsorted(daily["day"], [start_day, end_day + 1])
+    match = np.isin(daily["code"][lo:hi], selected_codes)
+    product = daily["product"][lo:hi][match]
+    net_sales = daily["net_sales"][lo:hi][match]
+    n_products = len(daily["products"])
+
+    def per_product(weights=None):
+        return np.bincount(product, weights, minlength=n_products)
+
+    totals = {
+        "net_sales": per_product(net_sales),
+        "units": per_product(daily["units"][lo:hi][match]).astype(np.int64),
+        "lines": per_product(daily["lines"][lo:hi][match]),
+    }
+    if margins is not None:
+        totals["profit"] = per_product(net_sales * margins[daily["code"][lo:hi][match]])
+    return totals
+
+
+def margin_basis(daily, start_day, end_day, selected_codes):
+    """
+    Net sales over [start_day, end_day] for the selected category codes: per
+    category code, and as sparse category x vendor and category x product
+    matrices, with line counts per category, vendor and product. Estimated
+    profit per group for a margin array indexed by category code (or a
+    category x scenario margin matrix) is then one matrix product.
+    """
+    lo, hi = np.searchsorted(daily["day"], [start_day, end_day + 1])
+    match = np.isin(daily["code"][lo:hi], selected_codes)
+    window = {
+        col: daily[col][lo:hi][match]
+        for col in ("code", "vendor", "product", "net_sales", "lines")
+    }
+    n_cats = len(daily["categories"])
+    basis = {
+        "category": np.bincount(window["code"], window["net_sales"], minlength=n_cats),
+        "category_lines": np.bincount(window["code"], window["lines"], minlength=n_cats),
+    }
+    for by, labels in (("vendor", "vendors"), ("product", "products")):
+        n_groups = len(daily[labels])
+        # Duplicate (category, group) entries are summed by the conversion
+        basis[by] = sparse.coo_matrix(
+            (window["net_sales"], (window["code"], window[by])), shape=(n_cats, n_groups)
+        ).tocsr()
+        basis[f"{by}_lines"] = np.bincount(window[by], window["lines"], minlength=n_groups)
+    return basis
+
+
+def product_search(daily, start_day, end_day, selected_codes, products=None, vendors=None):
+    """
+    Search table rows: (product, vendor, category) totals over [start_day,
+    end_day] for the selected category codes. When `products` / `vendors`
+    code arrays are given, only lines matching either are kept.
+    """
+    lo, hi = np.searchsorted(daily["day"], [start_day, end_day + 1])
+    window = {col: daily[col][lo:hi] for col in PRODUCT_DAILY_COLUMNS}
+    match = np.isin(window["code"], selected_codes) & (window["vendor"] >= 0)
+    if products is not None:
+        match &= np.isin(window["product"], products) | np.isin(window["vendor"], vendors)
+
+    n_vendors, n_cats = len(daily["vendors"]), len(daily["categories"])
+    key = (
+        window["product"][match].astype(np.int64) * n_vendors + window["vendor"][match]
+    ) * n_cats + window["code"][match]
+    groups, inverse = np.unique(key, return_inverse=True)
+    product, rest = np.divmod(groups, n_vendors * n_cats)
+    vendor, code = np.divmod(rest, n_cats)
+    return pd.DataFrame({
+        "Product Name": daily["products"][product],
+        "Vendor": daily["vendors"][vendor],
+        "Category": daily["categories"][code],
+        "Net Sales ($)": np.bincount(inverse, window["net_sales_whole"][match], len(groups)).astype(np.int64),
+        "Units Sold": np.bincount(inverse, window["units"][match], len(groups)).astype(np.int64),
+    })
+
+
+def top_k(values, present, k):
+    """Indices of the k largest `values` where `present`, largest first, without a full sort."""
+    candidates = np.flatnonzero(present)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-values[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+# ---- Trigram index over product and vendor names ----
+
+
+def build_name_index(names):
+    """Posting list of name codes per lower-case trigram of the distinct names."""
+    lowered = [str(name).lower() for name in names]
+    postings = {}
+    for code, name in enumerate(lowered):
+        for gram in {name[i : i + 3] for i in range(len(name) - 2)}:
+            postings.setdefault(gram, []).append(code)
+    return {
+        "names": lowered,
+        "postings": {gram: np.array(codes) for gram, codes in postings.items()},
+    }
+
+
+def search_names(index, query):
+    """
+    Codes of the names containing `query` (case-insensitive). Candidates are
+    the intersection of the query's trigram posting lists, checked against
+    the names; queries under three characters check every distinct name.
+    """
+    query = query.lower()
+    names = index["names"]
+    if len(query) < 3:
+        candidates = range(len(names))
+    else:
+        grams = {query[i : i + 3] for i in range(len(query) - 2)}
+        lists = sorted(
+            (index["postings"].get(gram, np.array([], dtype=np.int64)) for gram in grams),
+            key=len,
+        )
+        candidates = lists[0]
+        for codes in lists[1:]:
+            candidates = np.intersect1d(candidates, codes, assume_unique=True)
+    return np.array([code for code in candidates if query in names[code]], dtype=np.int64)
+
+
+def build_search_index(orders, items):
+    """Trigram indexes over the product and vendor labels (by category code)."""
+    return {
+        "products": build_name_index(items["product_name"].cat.categories),
+        "vendors": build_name_index(items["vendor_name"].cat.categories),
+    }
+
+
+# ---- Daily category x category co-occurrence counts ----
+
+
+def build_pair_cube(orders, items):
+    """
+    Per-day (category x category) counts of orders containing both
+    categories, with prefix sums over days, so the pair counts of a date
+    window are one difference of two matrices. The product of the order x
+    category incidence matrix with its (order x day*category) spread gives
+    every day at once, since each order falls on a single day.
+    """
+    codes, categories = category_codes(items)
+    n_cats = len(categories)
+    keep = codes >= 0
+    day = items["day"].to_numpy()[keep]
+    first_day = int(day.min()) if len(day) else 0
+    n_days = int(day.max()) - first_day + 1 if len(day) else 0
+
+    order_codes, _ = pd.factorize(items["order_id"].to_numpy()[keep])
+    n_orders = order_codes.max() + 1 if len(order_codes) else 0
+    ones = np.ones(len(order_codes))
+    incidence = sparse.csr_matrix(
+        (ones, (order_codes, codes[keep])), shape=(n_orders, n_cats)
+    )
+    by_day = sparse.csr_matrix(
+        (ones, (order_codes, (day - first_day).astype(np.int64) * n_cats + codes[keep])),
+        shape=(n_orders, n_days * n_cats),
+    )
+    # Repeated lines of a category in one order count once
+    incidence.data[:] = 1
+    by_day.data[:] = 1
+
+    # (a, day * n_cats + b) -> (day, a, b)
+    co_counts = (incidence.T @ by_day).toarray().astype(np.int64)
+    daily = co_counts.reshape(n_cats, n_days, n_cats).transpose(1, 0, 2)
+    return _finish_pair_cube(first_day, categories, np.ascontiguousarray(daily))
+
+
+def _finish_pair_cube(first_day, categories, daily):
+    prefix = np.concatenate([np.zeros((1,) + daily.shape[1:], dtype=daily.dtype), daily.cumsum(axis=0)])
+    return {"first_day": first_day, "categories": categories, "daily": daily, "prefix": prefix}
+
+
+def merge_pair_cube(cube, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Fold the touched orders into an existing pair cube: co-occurrence is
+    re-derived from all of their current lines, and the counts from their
+    earlier lines, already included, are taken out again.
+    """
+    if not len(new_items):
+        return cube
+    parts = [(cube, 1), (build_pair_cube(new_orders, new_items), 1)]
+    if len(earlier_items):
+        parts.append((build_pair_cube(earlier_orders, earlier_items), -1))
+    parts = [(part, sign) for part, sign in parts if len(part["daily"])]
+
+    first_day = min(part["first_day"] for part, _ in parts)
+    n_days = max(part["first_day"] + len(part["daily"]) for part, _ in parts) - first_day
+    # Appended labels extend the old list, so the longest one covers all codes
+    categories = max((part["categories"] for part, _ in parts), key=len)
+    daily = np.zeros((n_days, len(categories), len(categories)), dtype=np.int64)
+    for part, sign in parts:
+        values = part["daily"]
+        start = part["first_day"] - first_day
+        size = values.shape[1]
+        daily[start : start + len(values), :size, :size] += sign * values
+    return _finish_pair_cube(first_day, categories, daily)
+
+
+def pair_window(cube, start_day, end_day, selected_categories):
+    """
+    Category pairs over [start_day, end_day] among the selected labels, in
+    the pair_frame layout. Deselected categories are masked out
+    of the rows and columns of the window's count matrix.
+    """
+    n_days = len(cube["daily"])
+    lo = int(np.clip(start_day - cube["first_day"], 0, n_days))
+    hi = int(np.clip(end_day - cube["first_day"] + 1, lo, n_days))
+    selected = np.flatnonzero(cube["categories"].isin(list(selected_categories)))
+    co_counts = (cube["prefix"][hi] - cube["prefix"][lo])[np.ix_(selected, selected)]
+    return pair_frame(co_counts, cube["categories"][selected])
+
+
+# ---- Distinct customers per (day, category) ----
+
+# HyperLogLog registers per (day, category): 2**11 registers give a relative
+# standard error of 1.04 / sqrt(2**11), about 2.3%.
+HLL_PRECISION = 11
+HLL_ERROR = 1.04 / np.sqrt(2 ** HLL_PRECISION)
+
+
+def _customer_days(orders, items):
+    """Distinct (day, category code, customer id) rows, sorted by day."""
+    codes, _ = category_codes(items)
+    pairs = pd.DataFrame({"order_id": items["order_id"].to_numpy(), "code": codes})
+    pairs = pairs[pairs["code"] >= 0].drop_duplicates()
+    visits = orders[["order_id", "day", "customer_hash_id"]].dropna(subset=["customer_hash_id"])
+    return (
+        visits.merge(pairs, on="order_id")[["day", "code", "customer_hash_id"]]
+        .drop_duplicates()
+        .sort_values("day", kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def _hll_rank(hashes):
+    """Register index and rank (leading zeros + 1) of 64-bit hashes."""
+    index = (hashes & np.uint64(2 ** HLL_PRECISION - 1)).astype(np.int64)
+    rest = hashes >> np.uint64(HLL_PRECISION)
+    # Bit length of the remaining 64 - p bits by binary search
+    bits = np.zeros(len(rest), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = rest >= np.uint64(1 << shift)
+        bits[high] += shift
+        rest = np.where(high, rest >> np.uint64(shift), rest)
+    bits += rest > 0
+    return index, (64 - HLL_PRECISION - bits + 1).astype(np.uint8)
+
+
+def build_customer_sketch(orders, items):
+    """
+    Distinct (day, category, customer code) rows: a window and category
+    selection's distinct customers are a membership bitmap over integer
+    customer codes.
+    """
+    rows = _customer_days(orders, items)
+    customers = pd.Index(rows["customer_hash_id"].unique())
+    return {
+        "customers": customers,
+        "day": rows["day"].to_numpy(),
+        "code": rows["code"].to_numpy(),
+        "customer": customers.get_indexer(rows["customer_hash_id"]),
+    }
+
+
+def merge_customer_sketch(sketch, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Fold the touched orders into a customer sketch; customer codes stay
+    stable. Rows only ever gain members, so the union with the rows of
+    their current lines also covers lines joined across batches.
+    """
+    if not len(new_orders):
+        return sketch
+    delta = build_customer_sketch(new_orders, new_items)
+    customers = sketch["customers"].append(
+        delta["customers"].difference(sketch["customers"], sort=False)
+    )
+    delta_customers = customers.get_indexer(delta["customers"])[delta["customer"]]
+
+    rows = (
+        pd.DataFrame({
+            "day": np.concatenate([sketch["day"], delta["day"]]),
+            "code": np.concatenate([sketch["code"], delta["code"]]),
+            "customer": np.concatenate([sketch["customer"], delta_customers]),
+        })
+        .drop_duplicates()
+        .sort_values("day", kind="stable")
+    )
+    return {
+        "customers": customers,
+        "day": rows["day"].to_numpy(),
+        "code": rows["code"].to_numpy(),
+        "customer": rows["customer"].to_numpy(),
+    }
+
+
+def build_customer_registers(orders, items):
+    """
+    HyperLogLog registers per (day, category), merged with an elementwise
+    max over any window and selection. Only built for approximate counts.
+    Only non-zero registers are kept, as day-sorted (day, code, register
+    index, rank) entries, held in chunks (see merge below).
+    """
+    rows = _customer_days(orders, items)
+    index, rank = _hll_rank(pd.util.hash_array(rows["customer_hash_id"].to_numpy()))
+    entries = pd.DataFrame({
+        "day": rows["day"].to_numpy(), "code": rows["code"].to_numpy(), "index": index, "rank": rank,
+    })
+    return {"chunks": [_register_chunk(entries)] if len(entries) else []}
+
+
+def _register_chunk(entries):
+    """Max rank per (day, code, register index), as day-sorted arrays."""
+    entries = entries.groupby(["day", "code", "index"], sort=True)["rank"].max().reset_index()
+    return {
+        "day": entries["day"].to_numpy(np.int32),
+        "code": entries["code"].to_numpy(np.int32),
+        "index": entries["index"].to_numpy(np.int16),
+        "rank": entries["rank"].to_numpy(np.uint8),
+    }
+
+
+# Register chunks kept before a merge compacts them into one
+HLL_MAX_CHUNKS = 8
+
+
+def merge_customer_registers(sketch, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Add the registers of the touched orders' current lines as a new chunk,
+    leaving the earlier ones shared with the old version. A max-merge does
+    not mind a register repeated across chunks; every HLL_MAX_CHUNKS
+    appends the chunks are compacted, so an append does not copy them all.
+    """
+    if not len(new_orders):
+        return sketch
+    chunks = sketch["chunks"] + build_customer_registers(new_orders, new_items)["chunks"]
+    if len(chunks) > HLL_MAX_CHUNKS:
+        chunks = [_register_chunk(pd.concat([pd.DataFrame(c) for c in chunks], ignore_index=True))]
+    return {"chunks": chunks}
+
+
+def hll_estimate(registers):
+    """HyperLogLog cardinality estimate, with linear counting for small sets."""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = np.count_nonzero(registers == 0)
+    if raw <= 2.5 * m and zeros:
+        return m * np.log(m / zeros)
+    return raw
+
+
+def estimate_customers(sketch, start_day, end_day, selected_codes):
+    """HyperLogLog estimate of distinct_customers from the register aggregate."""
+    merged, found = np.zeros(2 ** HLL_PRECISION, dtype=np.uint8), False
+    for chunk in sketch["chunks"]:
+        lo, hi = np.searchsorted(chunk["day"], [start_day, end_day + 1])
+        match = np.flatnonzero(np.isin(chunk["code"][lo:hi], selected_codes)) + lo
+        if len(match):
+            np.maximum.at(merged, chunk["index"][match], chunk["rank"][match])
+            found = True
+    if not found:
+        return 0
+    return int(round(hll_estimate(merged)))
+
+
+def distinct_customers(sketch, start_day, end_day, selected_codes):
+    """Distinct customers with an order in [start_day, end_day] touching the selected codes."""
+    lo, hi = np.searchsorted(sketch["day"], [start_day, end_day + 1])
+    match = np.isin(sketch["code"][lo:hi], selected_codes)
+    seen = np.zeros(len(sketch["customers"]), dtype=bool)
+    seen[sketch["customer"][lo:hi][match]] = True
+    return int(np.count_nonzero(seen))
+
+
+# ---- Per-customer visit index ----
+
+
+def _visit_key(customer, day):
+    """Sort key of (customer code, day) pairs, customer-major."""
+    return (np.asarray(customer, dtype=np.int64) << 32) + (np.asarray(day, dtype=np.int64) + 2 ** 31)
+
+
+def _finish_visit_index(customers, customer, day, mask):
+    order = np.lexsort((day, customer))
+    customer, day = customer[order], day[order]
+    return {
+        "customers": customers,
+        # CSR layout: visits of customer c are offsets[c]:offsets[c + 1]
+        "offsets": np.concatenate([[0], np.bincount(customer, minlength=len(customers)).cumsum()]),
+        "key": _visit_key(customer, day),
+        "mask": None if mask is None else mask[order],
+    }
+
+
+def build_visit_index(orders, items):
+    """
+    Visit days of every customer (one entry per distinct order), grouped by
+    integer customer code and sorted by day within each customer. Visit
+    counts in a date window are two vectorized searchsorted calls over all
+    customers. Each entry keeps its order's category bitmask (None past 64
+    categories) for category-filtered counts.
+    """
+    masks = order_category_masks(orders, items)
+    visits = pd.DataFrame({
+        "customer_hash_id": orders["customer_hash_id"].to_numpy(),
+        "order_id": orders["order_id"].to_numpy(),
+        "day": orders["day"].to_numpy(),
+        "mask": masks if masks is not None else 0,
+    }).dropna(subset=["customer_hash_id"]).drop_duplicates(["customer_hash_id", "order_id"])
+
+    customers = pd.Index(visits["customer_hash_id"].unique())
+    return _finish_visit_index(
+        customers,
+        customers.get_indexer(visits["customer_hash_id"]),
+        visits["day"].to_numpy(),
+        visits["mask"].to_numpy(dtype=np.uint64) if masks is not None else None,
+    )
+
+
+def merge_visit_index(index, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Fold the touched orders into a visit index; customer codes stay stable.
+    Their entries are rebuilt from the current rows (an order's category
+    mask grows as more of its items arrive), and the entries built from
+    their earlier rows are taken out as a multiset.
+    """
+    if not len(new_orders):
+        return index
+    delta = build_visit_index(new_orders, new_items)
+    customers = index["customers"].append(
+        delta["customers"].difference(index["customers"], sort=False)
+    )
+    parts = [(index, 1), (delta, 1)]
+    if len(earlier_orders):
+        parts.append((build_visit_index(earlier_orders, earlier_items), -1))
+
+    def unpack(part):
+        code = np.repeat(np.arange(len(part["customers"])), np.diff(part["offsets"]))
+        return customers.get_indexer(part["customers"])[code], (part["key"] & (2 ** 32 - 1)) - 2 ** 31
+
+    has_masks = all(part["mask"] is not None for part, _ in parts)
+    entries = pd.concat([
+        pd.DataFrame({
+            "customer": unpack(part)[0],
+            "day": unpack(part)[1],
+            "mask": part["mask"] if has_masks else np.zeros(len(part["key"]), dtype=np.uint64),
+            "weight": sign,
+        })
+        for part, sign in parts
+    ])
+    if len(earlier_orders):
+        entries = entries.groupby(["customer", "day", "mask"]).sum().reset_index()
+        entries = entries.loc[entries.index.repeat(entries["weight"])]
+    return _finish_visit_index(
+        customers,
+        entries["customer"].to_numpy(),
+        entries["day"].to_numpy(),
+        entries["mask"].to_numpy(dtype=np.uint64) if has_masks else None,
+    )
+
+
+def visit_counts(index, start_day=None, end_day=None, selected_mask=None):
+    """
+    Visits per customer code in [start_day, end_day] (all time when None),
+    counting only orders matching `selected_mask` when given.
+    """
+    if start_day is None:
+        lo, hi = index["offsets"][:-1], index["offsets"][1:]
+    else:
+        codes = np.arange(len(index["customers"]))
+        lo = np.searchsorted(index["key"], _visit_key(codes, start_day))
+        hi = np.searchsorted(index["key"], _visit_key(codes, end_day + 1))
+    if selected_mask is None:
+        return hi - lo
+    matched = np.concatenate([[0], ((index["mask"] & selected_mask) != 0).cumsum()])
+    return matched[hi] - matched[lo]
+
+
+def repeat_share(counts):
+    """Percent of customers with a visit who visited at least twice."""
+    active = counts[counts > 0]
+    return (active > 1).mean() * 100 if len(active) else 0.0
+
+
+# ---- Day x hour x category-set rollup of order totals ----
+
+
+def order_category_masks(orders, items):
+    """
+    Bitmask over category codes of the items in each order row (0 = no
+    items), or None when there are more categories than fit in 64 bits.
+    """
+    codes, categories = category_codes(items)
+    if len(categories) > 64:
+        return None
+
+    pairs = pd.DataFrame({"order_id": items["order_id"].to_numpy(), "code": codes})
+    pairs = pairs[pairs["code"] >= 0].drop_duplicates()
+    bits = np.left_shift(np.uint64(1), pairs["code"].to_numpy().astype(np.uint64))
+    # Distinct bits per order, so their sum is the bitwise OR
+    order_masks = pd.Series(bits, index=pairs["order_id"].to_numpy()).groupby(level=0).sum()
+
+    pos = order_masks.index.get_indexer(orders["order_id"])
+    masks = np.zeros(len(pos), dtype=np.uint64)
+    masks[pos >= 0] = order_masks.to_numpy()[pos[pos >= 0]]
+    return masks
+
+
+def build_order_rollup(orders, items):
+    """
+    Order totals and counts rolled up by (day, hour, set of item categories
+    in the order), with the category set as a bitmask over category codes.
+    An order passes the category filter when its mask shares a bit with the
+    selection, so the revenue KPIs, the daily trend and the weekday/hour
+    views can be read from this small table.
+    Returns None when there are more categories than fit in 64 bits.
+    """
+    masks = order_category_masks(orders, items)
+    if masks is None:
+        return None
+    has_items = masks > 0
+
+    rollup = (
+        pd.DataFrame({
+            "day": orders["day"].to_numpy()[has_items],
+            "hour": orders["hour"].to_numpy()[has_items],
+            "mask": masks[has_items],
+            "total": orders["total"].to_numpy()[has_items],
+        })
+        .groupby(["day", "hour", "mask"], sort=True)
+        .agg(total=("total", "sum"), count=("total", "size"))
+        .reset_index()
+    )
+    return {col: rollup[col].to_numpy() for col in rollup.columns}
+
+
+def merge_order_rollup(rollup, new_orders, new_items, earlier_orders, earlier_items):
+    """
+    Fold the touched orders into a rollup: their rows under the current
+    category sets are added and their earlier rows (under the sets known
+    then) are taken out, so an order whose items arrive later moves groups.
+    """
+    if rollup is None:
+        return None
+    parts = [pd.DataFrame(rollup)]
+    for part_orders, part_items, sign in (
+        (new_orders, new_items, 1),
+        (earlier_orders, earlier_items, -1),
+    ):
+        if not len(part_orders):
+            continue
+        delta = build_order_rollup(part_orders, part_items)
+        if delta is None:
+            return None
+        delta = pd.DataFrame(delta)
+        delta[["total", "count"]] *= sign
+        parts.append(delta)
+    combined = (
+        pd.concat(parts)
+        .groupby(["day", "hour", "mask"], sort=True)
+        .agg(total=("total", "sum"), count=("count", "sum"))
+        .reset_index()
+    )
+    combined = combined[combined["count"] != 0]
+    return {col: combined[col].to_numpy() for col in combined.columns}
+
+
+def category_mask(categories, selected_categories):
+    """Bitmask of the selected labels over category codes."""
+    codes = categories.get_indexer(list(selected_categories))
+    codes = codes[codes >= 0].astype(np.uint64)
+    return np.bitwise_or.reduce(np.left_shift(np.uint64(1), codes), initial=np.uint64(0))
+
+
+def order_rollup_window(rollup, start_day, end_day, selected_mask):
+    """Rollup rows (day, hour, total, count) in the window matching the selection."""
+    lo, hi = np.searchsorted(rollup["day"], [start_day, end_day + 1])
+    match = (rollup["mask"][lo:hi] & selected_mask) != 0
+    return {col: rollup[col][lo:hi][match] for col in ("day", "hour", "total", "count")}
+
+
+def weekday_of_day(days):
+    """Weekday index (Monday = 0) of day numbers; 1970-01-01 was a Thursday."""
+    return (np.asarray(days, dtype=np.int64) + 3) % 7
+
+
+def weekday_hour_grid(day, hour, total, count):
+    """Revenue sums and order counts as dense 7 x 24 (weekday x hour) arrays."""
+    cell = weekday_of_day(day) * 24 + np.asarray(hour, dtype=np.int64)
+    totals = np.bincount(cell, total, minlength=7 * 24).reshape(7, 24)
+    counts = np.bincount(cell, count, minlength=7 * 24).reshape(7, 24)
+    return totals, counts
+
+
+# name -> (build(orders, items), merge(aggregate, new_orders, new_items,
+# earlier_orders, earlier_items) or None); see append_aggregates
+AGGREGATES = {
+    "category_cube": (build_category_cube, merge_category_cube),
+    "order_rollup": (build_order_rollup, merge_order_rollup),
+    "category_pairs": (build_pair_cube, merge_pair_cube),
+    "customer_sketch": (build_customer_sketch, merge_customer_sketch),
+    "customer_registers": (build_customer_registers, merge_customer_registers),
+    "visit_index": (build_visit_index, merge_visit_index),
+    "product_daily": (build_product_daily, merge_product_daily),
+    "search_index": (build_search_index, None),
+}
+
+
+# -----------------------------------------------------------
+# MARGIN MODEL (category margins, looked up by category code)
+# -----------------------------------------------------------
+
+# Margins are rough category-based estimates for stakeholder visibility
+margin_map = {
+    # core categories
+    "Flower": 0.45,
+    "Edibles": 0.50,
+    "Joint": 0.55,
+    "Joints": 0.55,
+    "Preroll Packs": 0.55,
+    "Pre-Rolls": 0.55,
+    "Prerolls": 0.55,
+    "Disposables": 0.48,
+    "Cartridges": 0.48,
+    "Concentrates": 0.52,
+    "Beverages": 0.40,
+    "Accessories": 0.60,
+}
+DEFAULT_MARGIN = 0.50
+
+# Optional margin table overriding the estimates above, as JSON:
+# {"margins": {"Flower": 0.45, ...}, "default": 0.50}
+MARGINS_PATH = os.environ.get("DASHBOARD_MARGINS", "margins.json")
+
+
+def load_margin_table(path=MARGINS_PATH):
+    """Margin table {"margins": {category: margin}, "default": margin}."""
+    if not os.path.exists(path):
+        return {"margins": dict(margin_map), "default": DEFAULT_MARGIN}
+    with open(path) as f:
+        config = json.load(f)
+    return {
+        "margins": {str(c): float(m) for c, m in config.get("margins", margin_map).items()},
+        "default": float(config.get("default", DEFAULT_MARGIN)),
+    }
+
+
+def category_margins(categories, table):
+    """
+    Margin per category label, plus a trailing default that code -1
+    (missing category) picks up when indexed by category codes.
+    """
+    default = table["default"]
+    return np.array([table["margins"].get(c, default) for c in categories] + [default])
+
+
+# ---- What-if scenarios ----
+
+# Editable margin scenarios shown next to the current margin table
+SCENARIO_NAMES = ("Scenario A", "Scenario B", "Scenario C")
+
+# Scenario ranking options: label -> (margin_basis group, product_daily labels)
+SCENARIO_RANKINGS = {
+    "Category": ("category", "categories"),
+    "Vendor": ("vendor", "vendors"),
+    "Product": ("product", "products"),
+}
+
+
+def scenario_margins(categories, tables):
+    """(category code x scenario) margin matrix for a sequence of margin tables."""
+    return np.column_stack([category_margins(categories, table)[:-1] for table in tables])
+
+
+def reprice(basis, margins):
+    """
+    Estimated profit per category, vendor and product (rows) for each
+    scenario (columns) of a category x scenario margin matrix. Only the
+    window's net sales aggregates are touched, never the line items.
+    """
+    return {
+        "category": basis["category"][:, None] * margins,
+        "vendor": basis["vendor"].T @ margins,
+        "product": basis["product"].T @ margins,
+    }
+
+
+def rank_desc(values):
+    """1-based rank of each value, largest first (ties keep their order)."""
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[np.argsort(-values, kind="stable")] = np.arange(1, len(values) + 1)
+    return ranks
+
+
+# -----------------------------------------------------------
+# METRIC GRAPH (derived metrics memoized on their inputs across reruns)
+# -----------------------------------------------------------
+
+# name -> (input names, compute(*input values)); inputs are filter values
+# or other metrics
+METRICS = {}
+
+
+def metric_node(*inputs):
+    """Register the decorated function as the metric of the same name."""
+    def register(compute):
+        METRICS[compute.__name__] = (inputs, compute)
+        return compute
+    return register
+
+
+def evaluate_metric(name, data, params, memo, keys=None):
+    """
+    Value of metric `name` for a data version under the filter values
+    `params`. `memo` (one per data version) keeps each node's last input key
+    and value, so a node only recomputes when a filter it depends on
+    (directly or through its inputs) has changed.
+    """
+    keys = {} if keys is None else keys
+    if name == "data":
+        keys[name] = None
+        return data
+    if name in params:
+        keys[name] = params[name]
+        return params[name]
+
+    inputs, compute = METRICS[name]
+    values = [evaluate_metric(dep, data, params, memo, keys) for dep in inputs]
+    key = tuple(keys[dep] for dep in inputs)
+    if name not in memo or memo[name][0] != key:
+        memo[name] = (key, compute(*values))
+    keys[name] = key
+    return memo[name][1]
+
+
+if PORTFOLIO_MODE and not ANON_KEY:
+    st.error(
+        "Portfolio mode needs a secret key: set the DASHBOARD_ANON_KEY environment "
+        "variable to a private string, or set PORTFOLIO_MODE = False in "
+        "analytics_dashboard.py to show the real data."
+    )
+    st.stop()
+
+data = refresh_data(ORDERS_PATH, ITEMS_PATH)
+df, items = data["orders"], data["items"]
+
+
+# ---------------------------
+#   CATEGORY FILTER (FINAL)
+# ---------------------------
+
+st.sidebar.header("Filters")
+
+
+min_date = day_to_date(df["day"].min()).item()
+max_date = day_to_date(df["day"].max()).item()
+
+# Date range
+date_range = st.sidebar.date_input(
+    "Date Range",
+    value=(min_date, max_date),
+    key="date_range"
+)
+if isinstance(date_range, (list, tuple)):
+    start_date, end_date = date_range
+else:
+    start_date = end_date = date_range
+
+# Widget dates -> day numbers once; every date filter below compares int32
+start_day, end_day = to_day(start_date), to_day(end_date)
+
+# Order minimum
+order_min_filter = st.sidebar.slider(
+    "Minimum Order Total ($)",
+    min_value=0.0,
+    max_value=float(round(df["total"].max(), 0)),
+    value=0.0,
+    step=1.0,
+    key="order_min"
+)
+
+# All categories
+all_categories = sorted(items["category"].cat.categories.tolist())
+
+# Initialize state
+if "selected_categories" not in st.session_state:
+    st.session_state.selected_categories = all_categories.copy()
+
+# Reset button
+if st.sidebar.button("Reset Categories"):
+    st.session_state._reset_categories_flag = True
+    st.rerun()
+
+# Handle reset before multiselect draws
+if st.session_state.get("_reset_categories_flag", False):
+    default_categories = all_categories.copy()
+    st.session_state.selected_categories = default_categories
+    st.session_state._reset_categories_flag = False
+else:
+    default_categories = st.session_state.selected_categories
+
+# Safe multiselect
+selected_categories = st.sidebar.multiselect(
+    "Product Categories",
+    options=all_categories,
+    key="selected_categories"
+)
+
+
+# Distinct-customer counting
+customer_count_mode = st.sidebar.radio(
+    "Customer Counts",
+    options=["Exact", "Approximate"],
+    horizontal=True,
+    key="customer_count_mode",
+    help=(
+        "Approximate counts come from HyperLogLog sketches, "
+        f"within about ±{HLL_ERROR:.1%} (one standard error)."
+    ),
+)
+approximate_customers = customer_count_mode == "Approximate"
+
+st.sidebar.markdown("---")
+st.sidebar.caption("Filters apply across all tabs.")
+
+# ---------------------------
+# APPLY FILTERS
+# ---------------------------
+
+
+@metric_node("data", "start_day", "end_day")
+def df_window(data, start_day, end_day):
+    # Date window: binary-search slice of the time-sorted table
+    return day_window(data["orders"], start_day, end_day)
+
+
+@metric_node("data", "start_day", "end_day")
+def items_window(data, start_day, end_day):
+    return day_window(data["items"], start_day, end_day)
+
+
+@metric_node("items_window", "categories")
+def items_filtered(items_window, categories):
+    # If nothing selected → empty frame
+    if not categories:
+        return items_window.iloc[0:0]
+    return items_window[items_window["category"].isin(categories)]
+
+
+@metric_node("df_window", "items_filtered", "categories", "order_min")
+def df_filtered(df_window, items_filtered, categories, order_min):
+    if not categories:
+        return df_window.iloc[0:0]
+
+    # Only include orders that appear in filtered items
+    valid_orders = items_filtered["order_id"].unique()
+    return df_window[
+        (df_window["total"] >= order_min)
+        & (df_window["order_id"].isin(valid_orders))
+    ]
+
+
+# ---------------------------
+# ROLLUP VIEWS
+# ---------------------------
+
+
+@metric_node("data", "start_day", "end_day", "categories")
+def category_totals(data, start_day, end_day, categories):
+    # Per-category totals for the date window + category filter (O(#categories))
+    return cube_window(get_aggregate(data, "category_cube"), start_day, end_day, categories)
+
+
+@metric_node("category_totals")
+def category_revenue(category_totals):
+    return category_totals.set_index("category")["net_sales"]
+
+
+@metric_node("data", "start_day", "end_day", "categories")
+def rollup_view(data, start_day, end_day, categories):
+    # Order-level rows from the (day, hour, category set) rollup, or None
+    # when there is no rollup or nothing is selected
+    order_rollup = get_aggregate(data, "order_rollup")
+    if order_rollup is None or not categories:
+        return None
+    categories_index = get_aggregate(data, "category_cube")["categories"]
+    return order_rollup_window(
+        order_rollup, start_day, end_day, category_mask(categories_index, categories)
+    )
+
+
+@metric_node("rollup_view", "df_filtered", "order_min")
+def revenue(rollup_view, df_filtered, order_min):
+    """(total revenue, average order value) for the filtered orders."""
+    # The order minimum filters individual order totals, so it needs the raw rows
+    if rollup_view is not None and order_min <= 0:
+        total = rollup_view["total"].sum()
+        n_orders = rollup_view["count"].sum()
+        return total, total / n_orders if n_orders else 0
+    total = df_filtered["total"].sum()
+    return total, df_filtered["total"].mean() if len(df_filtered) else 0
+
+
+@metric_node("rollup_view", "df_filtered", "order_min")
+def hour_grid(rollup_view, df_filtered, order_min):
+    # Weekday x hour revenue/order grid for the Time & Patterns tab
+    if rollup_view is not None and order_min <= 0:
+        return weekday_hour_grid(
+            rollup_view["day"], rollup_view["hour"], rollup_view["total"], rollup_view["count"]
+        )
+    return weekday_hour_grid(
+        df_filtered["day"], df_filtered["hour"], df_filtered["total"], np.ones(len(df_filtered))
+    )
+
+
+@metric_node(
+    "data", "start_day", "end_day", "categories", "order_min",
+    "approximate_customers", "df_filtered",
+)
+def unique_customers(data, start_day, end_day, categories, order_min, approximate, df_filtered):
+    # Distinct customers from the per-(day, category) sketches; the order
+    # minimum filters individual orders, so it still needs the raw rows.
+    # The HyperLogLog registers are only built once approximate counts are
+    # asked for.
+    if order_min <= 0:
+        count = estimate_customers if approximate else distinct_customers
+        return count(
+            get_aggregate(data, "customer_registers" if approximate else "customer_sketch"),
+            start_day,
+            end_day,
+            get_aggregate(data, "category_cube")["categories"].get_indexer(list(categories)),
+        )
+    return df_filtered["customer_hash_id"].nunique() if len(df_filtered) else 0
+
+
+@metric_node("data", "start_day", "end_day")
+def window_visits(data, start_day, end_day):
+    # Visits per customer code for every order in the window
+    return visit_counts(get_aggregate(data, "visit_index"), start_day, end_day)
+
+
+@metric_node("data", "start_day", "end_day", "categories", "order_min", "df_filtered")
+def filtered_visits(data, start_day, end_day, categories, order_min, df_filtered):
+    # Visits per customer for the orders passing the filters (raw rows when
+    # the order minimum is set)
+    visit_index = get_aggregate(data, "visit_index")
+    if (
+        categories
+        and order_min <= 0
+        and get_aggregate(data, "order_rollup") is not None
+        and visit_index["mask"] is not None
+    ):
+        categories_index = get_aggregate(data, "category_cube")["categories"]
+        return visit_counts(
+            visit_index, start_day, end_day, category_mask(categories_index, categories)
+        )
+    return df_filtered.groupby("customer_hash_id")["order_id"].nunique().to_numpy()
+
+
+@metric_node("window_visits", "df_filtered")
+def repeat_rate(window_visits, df_filtered):
+    # Repeat customer rate
+    return repeat_share(window_visits) if len(df_filtered) else 0.0
+
+
+@metric_node("data")
+def global_repeat_rate(data):
+    # Over all orders, ignoring the filters
+    return repeat_share(visit_counts(get_aggregate(data, "visit_index")))
+
+
+@metric_node("data", "margin_table")
+def margins(data, margin_table):
+    # Margin per category code; profit is net sales x margin, summed per group
+    return category_margins(get_aggregate(data, "category_cube")["categories"], margin_table)
+
+
+@metric_node("data", "start_day", "end_day", "categories")
+def sales_basis(data, start_day, end_day, categories):
+    codes = get_aggregate(data, "category_cube")["categories"].get_indexer(list(categories))
+    return margin_basis(get_aggregate(data, "product_daily"), start_day, end_day, codes)
+
+
+@metric_node("data", "category_totals", "sales_basis", "margins")
+def profit_summary(data, category_totals, sales_basis, margins):
+    # Estimated gross profit overall and per vendor, from window aggregates
+    vendor_sales = sales_basis["vendor"]
+    present = sales_basis["vendor_lines"] > 0
+    vendors = pd.DataFrame({
+        "vendor_name": get_aggregate(data, "product_daily")["vendors"],
+        "net_sales": np.asarray(vendor_sales.sum(axis=0)).ravel(),
+        "profit": vendor_sales.T @ margins[:-1],
+    })[present].reset_index(drop=True)
+    return {
+        "profit": category_totals["net_sales"] @ margins[category_totals["code"]],
+        "vendors": vendors,
+    }
+
+
+@metric_node("data", "sales_basis", "margin_scenarios")
+def scenario_profit(data, sales_basis, margin_scenarios):
+    # Every scenario repriced from the window aggregates in one pass
+    categories = get_aggregate(data, "category_cube")["categories"]
+    return reprice(sales_basis, scenario_margins(categories, margin_scenarios.values()))
+
+
+@metric_node("data", "start_day", "end_day", "categories")
+def pair_df(data, start_day, end_day, categories):
+    return pair_window(get_aggregate(data, "category_pairs"), start_day, end_day, categories)
+
+
+# ---- Per-tab views (computed only when their tab is open) ----
+
+
+@metric_node("rollup_view", "df_filtered", "order_min")
+def daily_revenue(rollup_view, df_filtered, order_min):
+    if rollup_view is not None and order_min <= 0:
+        daily = pd.DataFrame({"day": rollup_view["day"], "total": rollup_view["total"]})
+    else:
+        daily = df_filtered[["day", "total"]]
+    daily = daily.groupby("day")["total"].sum().reset_index()
+    daily["date"] = day_to_date(daily["day"])
+    return daily
+
+
+@metric_node("pair_df", "rollup_view", "items_filtered", "category_totals")
+def pair_rules(pair_df, rollup_view, items_filtered, category_totals):
+    # Orders in the filter, overall and per category, for the rule metrics
+    n_bundle_orders = (
+        rollup_view["count"].sum()
+        if rollup_view is not None
+        else items_filtered["order_id"].nunique()
+    )
+    return association_rules(
+        pair_df,
+        category_totals.set_index("category")["orders"],
+        n_bundle_orders,
+    )
+
+
+@metric_node("items_filtered", "min_bundle_orders")
+def product_itemsets(items_filtered, min_bundle_orders):
+    return frequent_itemsets(items_filtered[["order_id", "product_name"]], min_bundle_orders)
+
+
+@metric_node("df_filtered")
+def top_customers(df_filtered):
+    cs = (
+        df_filtered.groupby("customer_hash_id")
+        .agg(
+            total_spend=("total", "sum"),
+            visits=("order_id", "nunique"),
+        )
+        .reset_index()
+    )
+    cs["avg_ticket"] = cs["total_spend"] / cs["visits"]
+    return cs.sort_values("total_spend", ascending=False).head(20).reset_index(drop=True)
+
+
+# Filter values the metrics depend on. The memo lives for one data version
+# in this session, so a refresh starts from scratch.
+metric_params = {
+    "start_day": start_day,
+    "end_day": end_day,
+    "categories": tuple(st.session_state.selected_categories),
+    "order_min": order_min_filter,
+    "approximate_customers": approximate_customers,
+    "margin_table": load_margin_table(),
+}
+if st.session_state.get("metric_memo_data") is not data:
+    st.session_state.metric_memo_data = data
+    st.session_state.metric_memo = {}
+
+
+def metric(name):
+    return evaluate_metric(name, data, metric_params, st.session_state.metric_memo)
+
+
+# Shared by the KPI cards and most tabs; tab-specific metrics are
+# requested inside their tab
+items_filtered = metric("items_filtered")
+df_filtered = metric("df_filtered")
+category_totals = metric("category_totals")
+
+
+# -----------------------------------------------------------
+# KPI CARDS
 # -----------------------------------------------------------
-# TAB 2 — PRODUCTS (FULLY POLISHED)
-# -----------------------------------------------------------
 
-with tab_products:
+total_revenue, avg_order = metric("revenue")
+unique_customers = metric("unique_customers")
+customers_estimated = order_min_filter <= 0 and approximate_customers
+customers_note = f" (±{HLL_ERROR:.1%} estimate)" if customers_estimated else ""
+
+
+
+# Avg items/order (based on items table)
+if len(df_filtered) and len(items_filtered):
+    total_items = category_totals["units"].sum()
+    n_orders = df_filtered["order_id"].nunique()
+    avg_items_order = total_items / n_orders if n_orders else 0
+else:
+    avg_items_order = 0
+
+repeat_rate = metric("repeat_rate")
+
 
-    card_start()
+st.markdown("<br>", unsafe_allow_html=True)
+kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+
+
+def kpi_box(title, value, subtitle=None):
     st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>🧺 Product Performance</h3>",
+        f"""
+    <div style="
+        background-color:#ffffff;
+        border-radius:12px;
+        padding:18px 20px;
+        border-left:6px solid {PRIMARY_EMERALD};
+        box-shadow:0 1px 4px rgba(0,0,0,0.15);
+        height:100%;
+    ">
+        <h4 style="margin:0 0 4px 0; color:{KPI_TITLE}; font-size:15px;">{title}</h4>
+        <h2 style="margin:0; color:{PRIMARY_EMERALD}; font-size:24px;">{value}</h2>
+        {"<p style='margin:6px 0 0 0; color:#666; font-size:12px;'>" + subtitle + "</p>" if subtitle else ""}
+    </div>
+    """,
         unsafe_allow_html=True,
     )
 
-    if len(items_filtered):
 
-        drill = st.selectbox(
-            "Drill down by category",
-            options=["All"]
-            + sorted(items_filtered["category"].dropna().unique().tolist()),
-        )
+with kpi1:
+    kpi_box("Total Revenue", f"${total_revenue:,.2f}", "Across selected date range")
+with kpi2:
+    kpi_box("Average Order Value", f"${avg_order:,.2f}", "Per completed order")
+with kpi3:
+    kpi_box(
+        "Unique Customers",
+        f"{unique_customers:,}",
+        f"Distinct customers served{customers_note}",
+    )
+with kpi4:
+    kpi_box(
+        "Repeat Customer Rate",
+        f"{repeat_rate:.1f}%",
+        "Share of customers with 2+ visits",
+    )
 
-        if drill == "All":
-            items_drill = items_filtered.copy()
-        else:
-            items_drill = items_filtered[items_filtered["category"] == drill].copy()
+# Little “snapshot” line under KPIs
+total_orders_selected = df_filtered["order_id"].nunique()
+total_items_selected = category_totals["units"].sum() if len(category_totals) else 0
 
-        if len(items_drill):
 
-            # Group + clean formatting
-            top_products = (
-                items_drill.groupby("product_name")["net_sales"]
-                .sum()
-                .reset_index()
-                .sort_values("net_sales", ascending=False)
-                .head(15)
-            )
+st.markdown(
+    f"""
+    <div style="margin-top:8px; margin-bottom:10px;">
+        <span class="snapshot-pill">📅 {start_date} → {end_date}</span>
+        <span class="snapshot-pill">🧾 {total_orders_selected:,} orders</span>
+        <span class="snapshot-pill">🧺 {total_items_selected:,} items</span>
+        <span class="snapshot-pill">🏷️ {len(selected_categories)} categories</span>
+    </div>
+    """,
+    unsafe_allow_html=True,
+)
 
-            # Create clean numeric + label columns
-            top_products["Net Sales ($)"] = top_products["net_sales"].round().astype(int)
-            top_products["Product Name"] = top_products["product_name"]
+st.markdown("---")
 
-            # Shortened name for chart only
-            top_products["Short Name"] = top_products["Product Name"].apply(
-                lambda x: x if len(x) <= 40 else x[:40] + "..."
-            )
 
-            # 🔥 Correct descending barrel order
-            top_products = top_products.sort_values("Net Sales ($)", ascending=False)
+# -----------------------------------------------------------
+# SECTION WRAPPER HELPERS
+# -----------------------------------------------------------
 
-            # Dynamic chart height
-            chart_height = max(450, len(top_products) * 45)
 
-            # --- Clean, professional bar chart ---
+def card_start():
+    st.markdown("<div class='section-card'>", unsafe_allow_html=True)
 
-            # Choose a single clean green (or switch to teal/blue here)
-            BAR_COLOR = PRIMARY_EMERALD  # or "#4CB3D4" for teal
 
-            fig_prod = px.bar(
-                top_products,
-                x="Net Sales ($)",
-                y="Product Name",
-                orientation="h",
-                title=f"Top Products — {drill}",
+def card_end():
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+# -----------------------------------------------------------
+# HELPER: category pair tables (auto-generated bundling)
+# -----------------------------------------------------------
+
+
+def pair_frame(co_counts, names):
+    """
+    Pair table from a symmetric (category x category) co-occurrence matrix,
+    one row per pair with a non-zero count, most frequent first.
+    """
+    columns = ["category_a", "category_b", "pair_count"]
+    co_counts = sparse.triu(sparse.coo_matrix(co_counts), k=1).tocoo()
+    co_counts.eliminate_zeros()
+    if not co_counts.nnz:
+        return pd.DataFrame(columns=columns)
+
+    # Put each pair in name order, as sorted(set(...)) per order would
+    a = np.asarray(names)[co_counts.row]
+    b = np.asarray(names)[co_counts.col]
+    swap = a > b
+    pair_counts = pd.DataFrame({
+        "category_a": np.where(swap, b, a),
+        "category_b": np.where(swap, a, b),
+        "pair_count": co_counts.data.astype(np.int64),
+    })
+    return pair_counts.sort_values(
+        ["pair_count", "category_a", "category_b"], ascending=[False, True, True]
+    ).reset_index(drop=True)
+
+
+def association_rules(pair_df, category_orders, n_orders):
+    """
+    Support, confidence (both directions) and lift for every pair at once.
+    `category_orders` maps each category to the number of orders containing
+    it; `n_orders` is the number of orders in the same filter.
+    """
+    rules = pair_df.copy()
+    count = rules["pair_count"].to_numpy(dtype=float)
+    orders_a = category_orders.reindex(rules["category_a"]).to_numpy(dtype=float)
+    orders_b = category_orders.reindex(rules["category_b"]).to_numpy(dtype=float)
+    rules["support"] = count / n_orders if n_orders else np.nan
+    rules["confidence_ab"] = count / orders_a
+    rules["confidence_ba"] = count / orders_b
+    rules["lift"] = count * n_orders / (orders_a * orders_b)
+    return rules
+
+
+# Bundles tab ranking options: label -> rules column
+PAIR_RANKINGS = {
+    "Number of Orders": "pair_count",
+    "Lift": "lift",
+    "Support": "support",
+    "Confidence (A → B)": "confidence_ab",
+    "Confidence (B → A)": "confidence_ba",
+}
+
+
+# -----------------------------------------------------------
+# HELPER: product-level frequent itemsets (pairs and triples)
+# -----------------------------------------------------------
+
+BUNDLE_TOP_K = 10
+
+
+def frequent_itemsets(items_df, min_support, top_k=BUNDLE_TOP_K, column="product_name"):
+    """
+    Product pairs and triples bought together in at least `min_support`
+    orders, by a vectorized Apriori over a sparse order x product incidence
+    matrix. Products below the threshold are dropped before any pair is
+    counted, and triples are only grown from frequent pairs, so memory
+    follows the frequent part of the catalog rather than its size.
+    Returns: DataFrame[itemset, size, orders, support], the top_k sets of
+    each size, most frequent first.
+    """
+    columns = ["itemset", "size", "orders", "support"]
+    items_df = items_df.dropna(subset=[column])
+    if items_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    labels = items_df[column].astype("category")
+    names = labels.cat.categories.to_numpy()
+    order_codes, order_index = pd.factorize(items_df["order_id"])
+    n_orders = len(order_index)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(order_codes)), (order_codes, labels.cat.codes.to_numpy())),
+        shape=(n_orders, len(names)),
+    )
+    incidence.data[:] = 1
+
+    # Frequent single products
+    frequent = np.flatnonzero(np.asarray(incidence.sum(axis=0)).ravel() >= min_support)
+    incidence = incidence[:, frequent].tocsc()
+    names = names[frequent]
+
+    # Frequent pairs (a < b)
+    pairs = sparse.triu(incidence.T @ incidence, k=1).tocoo()
+    keep = pairs.data >= min_support
+    pair_a, pair_b, pair_n = pairs.row[keep], pairs.col[keep], pairs.data[keep]
+
+    # Frequent triples (a < b < c): orders holding each frequent pair x products
+    holds_pair = incidence[:, pair_a].multiply(incidence[:, pair_b]).tocsc()
+    triples = (holds_pair.T @ incidence).tocoo()
+    keep = (triples.col > pair_b[triples.row]) & (triples.data >= min_support)
+    rows = triples.row[keep]
+
+    found = []
+    for members, counts in (
+        ((pair_a, pair_b), pair_n),
+        ((pair_a[rows], pair_b[rows], triples.col[keep]), triples.data[keep]),
+    ):
+        if not len(counts):
+            continue
+        top = np.argsort(-counts, kind="stable")[:top_k]
+        # Products within a set in name order
+        set_names = np.sort(np.column_stack([names[m[top]] for m in members]), axis=1)
+        found.append(pd.DataFrame({
+            "itemset": [" + ".join(row) for row in set_names],
+            "size": len(members),
+            "orders": counts[top].astype(np.int64),
+        }))
+
+    if not found:
+        return pd.DataFrame(columns=columns)
+    itemsets = pd.concat(found, ignore_index=True)
+    itemsets["support"] = itemsets["orders"] / n_orders
+    return itemsets.sort_values(
+        ["size", "orders", "itemset"], ascending=[True, False, True]
+    ).reset_index(drop=True)
+
+
+# -----------------------------------------------------------
+# TABS
+# -----------------------------------------------------------
+
+# Selecting a tab reruns the script and only the open tab's section runs;
+# its metrics stay memoized on the filter state, so switching back is free.
+# Streamlit drops the state of widgets that are not rendered in a run, so
+# the tab widgets' values are carried over while another tab is open.
+# Their defaults are seeded here, not passed as `value=`: Streamlit warns
+# when a widget has both a default and a value set through Session State.
+TAB_WIDGET_KEYS = (
+    "product_drill", "product_query", "pair_ranking", "min_bundle_orders", "scenario_ranking",
+)
+TAB_WIDGET_DEFAULTS = {"min_bundle_orders": 5}
+for key in TAB_WIDGET_KEYS:
+    if key in st.session_state:
+        st.session_state[key] = st.session_state[key]
+for key, value in TAB_WIDGET_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
+
+tab_overview, tab_products, tab_bundles, tab_customers, tab_time, tab_profit, tab_insights = st.tabs(
+    [
+        "📍 Overview",
+        "🧺 Products",
+        "🔗 Bundles & Pairings",
+        "👥 Customers",
+        "⏱ Time & Patterns",
+        "💵 Profitability",
+        "💡 Insights",
+    ],
+    key="dashboard_tab",
+    on_change="rerun",
+)
+
+
+# -----------------------------------------------------------
+# TAB 1 — OVERVIEW
+# -----------------------------------------------------------
+
+if tab_overview.open:
+    with tab_overview:
+
+        # Executive summary
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>🧾 Executive Summary</h3>",
+            unsafe_allow_html=True,
+        )
+
+        if len(df_filtered) and len(items_filtered):
+            total_orders = df_filtered["order_id"].nunique()
+
+
+            # Category revenue
+            category_revenue = metric("category_revenue")
+            if not category_revenue.empty:
+                top_category = "Category Segment A"
+                top_share = category_revenue.max() / category_revenue.sum() * 100
+            else:
+                top_category, top_share = "N/A", 0.0
+
+            # Category logic
+            if len(category_revenue) == 1:
+                category_sentence = (
+                    f"All sales in the selected filters come from the <b>{top_category}</b> category."
+                )
+            else:
+                category_sentence = (
+                    f"<b>{top_category}</b> is currently the leading category, "
+                    f"accounting for <b>{top_share:.1f}%</b> of category-level revenue."
+                )
+
+            # Repeat rates
+            repeat_rate_filtered = repeat_share(metric("filtered_visits"))
+            repeat_rate_global = repeat_share(metric("window_visits"))
+
+            # 🔥 NEW LOGIC — ONLY SHOW COMPARISON IF USER SELECTED A SUBSET
+            all_selected = set(selected_categories) == set(all_categories)
+
+            if all_selected:
+                repeat_sentence = (
+                    f"Roughly <b>{repeat_rate_global:.1f}%</b> of customers are repeat buyers."
+                )
+            else:
+                repeat_sentence = (
+                    f"Roughly <b>{repeat_rate_filtered:.1f}%</b> of customers who purchased within these filters "
+                    f"are repeat buyers, while the overall repeat rate across all customers in this date range "
+                    f"is <b>{repeat_rate_global:.1f}%</b>."
+                )
+
+            # Final summary
+            st.markdown(
+                f"""
+                <div style="max-width:1100px; line-height:1.6; font-size:15px;">
+                    This view summarizes <b>{total_orders:,}</b> orders over the selected period. 
+                    Customers spend an average of <b>${avg_order:,.2f}</b> per visit and purchase about 
+                    <b>{avg_items_order:.2f}</b> items per basket. 
+                    {repeat_sentence} {category_sentence}
+                </div>
+                """,
+                unsafe_allow_html=True,
             )
 
-            # Make all bars the same color
-            fig_prod.update_traces(
-                marker_color=BAR_COLOR,
-                text=top_products["Net Sales ($)"],
-                texttemplate="$%{text:,.0f}",
-                textposition="outside",
-                hovertemplate="<b>%{y}</b><br>Net Sales: $%{x:,.2f}<extra></extra>",
+        else:
+            st.markdown(
+                "<p style='font-size:14px;'>Adjust filters to see executive KPIs and narrative summary.</p>",
+                unsafe_allow_html=True,
             )
 
-            # Reverse Y so highest is at the top
-            fig_prod.update_yaxes(
-                autorange="reversed",
-                title="Product",
-                tickfont=dict(color=BRIGHT_MINT),
+        card_end()
+
+
+
+
+
+        # Revenue Over Time
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>📅 Revenue Over Time</h3>",
+            unsafe_allow_html=True,
+        )
+
+        if len(df_filtered):
+            daily_revenue = metric("daily_revenue")
+
+            fig = px.line(
+                daily_revenue,
+                x="date",
+                y="total",
+                title="Daily Revenue Trend",
+                labels={"date": "Date", "total": "Revenue ($)"},
             )
 
-            fig_prod.update_xaxes(
-                title="Net Sales ($)",
-                tickfont=dict(color=BRIGHT_MINT),
+            fig.update_traces(
+                line=dict(width=4, color=BRIGHT_MINT),
+                hovertemplate="<b>%{x|%b %d, %Y}</b><br>Revenue: $%{y:,.2f}<extra></extra>",
             )
 
+            fig.update_xaxes(
+                showgrid=False,
+                showline=True,
+                linecolor=BRIGHT_MINT,
+                tickfont=dict(color=BRIGHT_MINT, size=11),
+                tickformat="%b %d",
+                showticklabels=True,
+            )
+            fig.update_yaxes(
+                showgrid=False,
+                showline=True,
+                linecolor=BRIGHT_MINT,
+                tickfont=dict(color=BRIGHT_MINT, size=11),
+            )
 
-            # Disable ALL interaction (tablet-safe)
-            fig_prod.update_layout(
-                dragmode=False,                  # no dragging
-                modebar=dict(                    # remove all zoom tools
+            # Disable ALL zoom / scroll / drag interactions
+            fig.update_xaxes(fixedrange=True)
+            fig.update_yaxes(fixedrange=True)
+        
+            fig.update_layout(
+                dragmode=False,
+                modebar=dict(
                     remove=[
                         "zoom",
                         "pan",
@@ -950,937 +2613,1166 @@ with tab_products:
                         "autoScale",
                         "resetScale"
                     ]
-                ),
-                template=plotly_template,
-                height=450,
-                showlegend=False,
-                margin=dict(l=0, r=20, t=80, b=30)
+                )
             )
+        
+            fig.update_layout(template=plotly_template, height=360)
 
-
-            fig_prod = clean_axes(fig_prod)  # still keeps your style helpers
+            fig = clean_axes(fig)
             with st.container():
                 st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-                st.plotly_chart(fig_prod, use_container_width=True)
+                st.plotly_chart(fig, use_container_width=True)
                 st.markdown("</div>", unsafe_allow_html=True)
 
         else:
-            st.info("No product data for selected category.")
-
-    else:
-        st.info("No product data.")
-    card_end()
-
-    # SEARCH TABLE
-    card_start()
-    st.markdown("#### 🔍 Search Products")
-
-    if len(items_filtered):
-        query = st.text_input("Search by product or vendor:")
-
-        table = items_filtered[
-            ["product_name", "vendor_name", "category", "net_sales", "total_inventory_sold"]
-        ].copy()
-
-        table = table.rename(
-            columns={
-                "product_name": "Product Name",
-                "vendor_name": "Vendor",
-                "category": "Category",
-                "net_sales": "Net Sales ($)",
-                "total_inventory_sold": "Units Sold",
-            }
-        )
-
-        # Proper numeric formatting
-        table["Net Sales ($)"] = table["Net Sales ($)"].round().astype(int)
+            st.info("No data for selected filters.")
+        card_end()
 
-        if query:
-            mask = (
-                table["Product Name"].str.contains(query, case=False, na=False)
-                | table["Vendor"].str.contains(query, case=False, na=False)
-            )
-            table = table[mask]
-
-        table = table.groupby(["Product Name", "Vendor", "Category"]).agg(
-            **{
-                "Net Sales ($)": ("Net Sales ($)", "sum"),
-                "Units Sold": ("Units Sold", "sum"),
-            }
-        ).reset_index()
-
-        table = table.sort_values("Net Sales ($)", ascending=False)
-
-        # Add formatting ($XX,XXX)
-        table["Net Sales ($)"] = table["Net Sales ($)"].apply(lambda x: f"${x:,}")
-        table["Units Sold"] = table["Units Sold"].apply(lambda x: f"{x:,}")
-
-        # Right-align numeric columns
-        st.dataframe(
-            table.style.set_properties(
-                **{"text-align": "right"},
-                subset=["Net Sales ($)", "Units Sold"],
-            ),
-            use_container_width=True,
-            hide_index=True,
-            height=450,
-        )
-
-    else:
-        st.info("No product data for current filters.")
-    card_end()
 
 # -----------------------------------------------------------
-# TAB 3 — BUNDLES & PAIRINGS (FINAL POLISHED VERSION)
+# TAB 2 — PRODUCTS (FULLY POLISHED)
 # -----------------------------------------------------------
 
-with tab_bundles:
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>🔗 Bundles & Category Pairings</h3>",
-        unsafe_allow_html=True,
-    )
-
-    if len(items_filtered):
+if tab_products.open:
+    with tab_products:
 
-        pair_df = compute_category_pairs(items_filtered[["order_id", "category"]])
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>🧺 Product Performance</h3>",
+            unsafe_allow_html=True,
+        )
 
-        if not pair_df.empty:
+        if len(items_filtered):
 
-            # --- Clean Top Pairs dataframe ---
-            top_pairs = pair_df.head(10).copy()
-            top_pairs["Category Pair"] = (
-                top_pairs["category_a"] + " + " + top_pairs["category_b"]
+            drill = st.selectbox(
+                "Drill down by category",
+                options=["All"] + sorted(category_totals["category"].tolist()),
+                key="product_drill",
             )
 
-            display_pairs = top_pairs.copy()
-            display_pairs["pair_count"] = display_pairs["pair_count"].apply(
-                lambda x: f"{int(x):,}"
+            # Per-product totals for the drill-down from the daily product rows
+            product_daily = get_aggregate(data, "product_daily")
+            drill_codes = (
+                category_totals["code"].to_numpy()
+                if drill == "All"
+                else category_totals.loc[category_totals["category"] == drill, "code"].to_numpy()
             )
+            product_sales = product_window(product_daily, start_day, end_day, drill_codes)
+            has_lines = product_sales["lines"] > 0
 
-            # ----------------------------------------
-            # FORCE CONSISTENT HEIGHT FOR SPLIT LAYOUT
-            # ----------------------------------------
-            TABLE_CHART_HEIGHT = 385  # <-- You can change this, but this matches your screenshot perfectly
+            if has_lines.any():
 
-            c1, c2 = st.columns([1.05, 1.95])
+                # Top 15 by partial selection + clean formatting
+                top = top_k(product_sales["net_sales"], has_lines, 15)
+                top_products = pd.DataFrame({
+                    "product_name": product_daily["products"][top],
+                    "net_sales": product_sales["net_sales"][top],
+                })
 
-            # ----------- TABLE -----------
-            with c1:
-                st.markdown("**Top 10 Category Pairs (by order frequency)**")
-                st.dataframe(
-                    display_pairs.rename(
-                        columns={
-                            "category_a": "Category A",
-                            "category_b": "Category B",
-                            "pair_count": "Number of Orders",
-                        }
-                    )[["Category A", "Category B", "Number of Orders"]],
-                    use_container_width=True,
-                    hide_index=True,
-                    height=TABLE_CHART_HEIGHT,   # 🔥 forced height
+                # Create clean numeric + label columns
+                top_products["Net Sales ($)"] = top_products["net_sales"].round().astype(int)
+                top_products["Product Name"] = top_products["product_name"]
+
+                # Shortened name for chart only
+                top_products["Short Name"] = top_products["Product Name"].apply(
+                    lambda x: x if len(x) <= 40 else x[:40] + "..."
                 )
 
-            # ----------- CHART -----------
-            with c2:
-                BAR_COLOR = PRIMARY_EMERALD
+                # 🔥 Correct descending barrel order
+                top_products = top_products.sort_values("Net Sales ($)", ascending=False)
+
+                # Dynamic chart height
+                chart_height = max(450, len(top_products) * 45)
 
-                top_pairs_sorted = top_pairs.sort_values("pair_count", ascending=False)
+                # --- Clean, professional bar chart ---
 
-                fig_pairs = px.bar(
-                    top_pairs_sorted,
-                    x="pair_count",
-                    y="Category Pair",
+                # Choose a single clean green (or switch to teal/blue here)
+                BAR_COLOR = PRIMARY_EMERALD  # or "#4CB3D4" for teal
+
+                fig_prod = px.bar(
+                    top_products,
+                    x="Net Sales ($)",
+                    y="Product Name",
                     orientation="h",
-                    title="Most Common Bundles",
-                    labels={
-                        "pair_count": "Number of Orders",
-                        "Category Pair": "Category Pair",
-                    },
+                    title=f"Top Products — {drill}",
                 )
 
-                fig_pairs.update_traces(
+                # Make all bars the same color
+                fig_prod.update_traces(
                     marker_color=BAR_COLOR,
-                    text=top_pairs_sorted["pair_count"],
-                    texttemplate="%{text:,}",
+                    text=top_products["Net Sales ($)"],
+                    texttemplate="$%{text:,.0f}",
                     textposition="outside",
-                    hovertemplate="<b>%{y}</b><br>Orders: %{x:,}<extra></extra>",
+                    hovertemplate="<b>%{y}</b><br>Net Sales: $%{x:,.2f}<extra></extra>",
                 )
 
-                fig_pairs.update_yaxes(
+                # Reverse Y so highest is at the top
+                fig_prod.update_yaxes(
                     autorange="reversed",
+                    title="Product",
                     tickfont=dict(color=BRIGHT_MINT),
                 )
-                fig_pairs.update_xaxes(
+
+                fig_prod.update_xaxes(
+                    title="Net Sales ($)",
                     tickfont=dict(color=BRIGHT_MINT),
-                    title="Number of Orders",
                 )
 
-                fig_pairs.update_layout(
+
+                # Disable ALL interaction (tablet-safe)
+                fig_prod.update_layout(
+                    dragmode=False,                  # no dragging
+                    modebar=dict(                    # remove all zoom tools
+                        remove=[
+                            "zoom",
+                            "pan",
+                            "select",
+                            "lasso",
+                            "zoomIn",
+                            "zoomOut",
+                            "autoScale",
+                            "resetScale"
+                        ]
+                    ),
                     template=plotly_template,
-                    height=470,  # 🔥 MATCH THE TABLE
-                    margin=dict(l=0, r=20, t=70, b=10),
+                    height=450,
                     showlegend=False,
+                    margin=dict(l=0, r=20, t=80, b=30)
                 )
 
-                # Remove zoom tools (fixes your “bug out” issue)
-                fig_pairs.update_layout(
-                    dragmode=False
-                )
 
-                fig_pairs = clean_axes(fig_pairs)
+                fig_prod = clean_axes(fig_prod)  # still keeps your style helpers
                 with st.container():
                     st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-                    st.plotly_chart(
-                        fig_pairs,
-                        use_container_width=True,
-                        config={"displayModeBar": False},  # 🔥 NO ZOOM BAR
-                    )
+                    st.plotly_chart(fig_prod, use_container_width=True)
                     st.markdown("</div>", unsafe_allow_html=True)
-            # ---- Divider matching Overview tab ----
-            st.markdown("<hr style='opacity:0.25;'>", unsafe_allow_html=True)
 
-            # ----------- CENTERED INSIGHT BOX -----------
-            top_row = top_pairs_sorted.iloc[0]
-            pair_count_value = int(top_row["pair_count"])
+            else:
+                st.info("No product data for selected category.")
+
+        else:
+            st.info("No product data.")
+        card_end()
+
+        # SEARCH TABLE
+        card_start()
+        st.markdown("#### 🔍 Search Products")
+
+        if len(items_filtered):
+            query = st.text_input("Search by product or vendor:", key="product_query")
+
+            # Query -> product/vendor codes via the trigram index, then the
+            # matching (product, vendor, category) totals from the daily rows
+            matched_products = matched_vendors = None
+            if query:
+                search_index = get_aggregate(data, "search_index")
+                matched_products = search_names(search_index["products"], query)
+                matched_vendors = search_names(search_index["vendors"], query)
+
+            table = product_search(
+                get_aggregate(data, "product_daily"),
+                start_day,
+                end_day,
+                category_totals["code"].to_numpy(),
+                matched_products,
+                matched_vendors,
+            )
+
+            table = table.sort_values("Net Sales ($)", ascending=False)
+
+            # Numeric columns render right-aligned as $XX,XXX / X,XXX
+            st.dataframe(
+                table,
+                use_container_width=True,
+                hide_index=True,
+                height=450,
+                column_config=number_columns({"Net Sales ($)": "dollars", "Units Sold": "number"}),
+            )
+
+        else:
+            st.info("No product data for current filters.")
+        card_end()
+
+# -----------------------------------------------------------
+# TAB 3 — BUNDLES & PAIRINGS (FINAL POLISHED VERSION)
+# -----------------------------------------------------------
+
+if tab_bundles.open:
+    with tab_bundles:
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>🔗 Bundles & Category Pairings</h3>",
+            unsafe_allow_html=True,
+        )
+
+        if len(items_filtered):
+
+            pair_df = metric("pair_df")
 
-            st.markdown(
-                f"""
-                <div style="
-                    background-color:#111111;
-                    padding:20px;
-                    border-radius:10px;
-                    border:1px solid rgba(255,255,255,0.08);
-                    max-width:1000px;
-                    margin-left:auto;
-                    margin-right:auto;
-                    text-align:center;
-                    line-height:1.6;
-                ">
-                    <p style="font-size:15px; color:#E8F7F0;">
-                        Customers show strong bundling behavior. The most frequent pairing is
-                        <b>{top_row['category_a']} + {top_row['category_b']}</b>,
-                        appearing together in <b>{pair_count_value:,}</b> orders during the
-                        selected period. These represent ideal opportunities for curated bundle
-                        deals and high-visibility cross-sell prompts at checkout.
-                    </p>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
+            if not pair_df.empty:
 
-        else:
-            st.info("Not enough category diversity to compute bundles for these filters.")
+                pair_rules = metric("pair_rules")
 
-    else:
-        st.info("No item data for selected filters.")
+                rank_label = st.selectbox(
+                    "Rank pairs by",
+                    options=list(PAIR_RANKINGS),
+                    key="pair_ranking",
+                )
+                rank_col = PAIR_RANKINGS[rank_label]
 
-    card_end()
+                # --- Clean Top Pairs dataframe ---
+                top_pairs = (
+                    pair_rules.sort_values(rank_col, ascending=False, kind="stable")
+                    .head(10)
+                    .copy()
+                )
+                top_pairs["Category Pair"] = (
+                    top_pairs["category_a"] + " + " + top_pairs["category_b"]
+                )
 
+                display_pairs = top_pairs.copy()
+                display_pairs[["support", "confidence_ab", "confidence_ba"]] *= 100
+
+                # ----------------------------------------
+                # FORCE CONSISTENT HEIGHT FOR SPLIT LAYOUT
+                # ----------------------------------------
+                TABLE_CHART_HEIGHT = 385  # <-- You can change this, but this matches your screenshot perfectly
+
+                c1, c2 = st.columns([1.05, 1.95])
+
+                # ----------- TABLE -----------
+                with c1:
+                    rank_title = "order frequency" if rank_col == "pair_count" else rank_label.lower()
+                    st.markdown(f"**Top 10 Category Pairs (by {rank_title})**")
+                    st.dataframe(
+                        display_pairs.rename(
+                            columns={
+                                "category_a": "Category A",
+                                "category_b": "Category B",
+                                **{col: label for label, col in PAIR_RANKINGS.items()},
+                            }
+                        )[["Category A", "Category B", *PAIR_RANKINGS]],
+                        use_container_width=True,
+                        hide_index=True,
+                        height=TABLE_CHART_HEIGHT,   # 🔥 forced height
+                        column_config=number_columns({
+                            "Number of Orders": "count",
+                            "Lift": "ratio",
+                            "Support": "percent",
+                            "Confidence (A → B)": "percent",
+                            "Confidence (B → A)": "percent",
+                        }),
+                    )
 
+                # ----------- CHART -----------
+                with c2:
+                    BAR_COLOR = PRIMARY_EMERALD
+
+                    top_pairs_sorted = top_pairs.sort_values(rank_col, ascending=False, kind="stable")
+                    value_format = {
+                        "pair_count": ",", "lift": ".2f",
+                    }.get(rank_col, ".1%")
+
+                    fig_pairs = px.bar(
+                        top_pairs_sorted,
+                        x=rank_col,
+                        y="Category Pair",
+                        orientation="h",
+                        title="Most Common Bundles" if rank_col == "pair_count" else "Strongest Bundles",
+                        labels={
+                            rank_col: rank_label,
+                            "Category Pair": "Category Pair",
+                        },
+                    )
 
-# -----------------------------------------------------------
-# TAB 4 — CUSTOMERS (FINAL FIXED VERSION)
-# -----------------------------------------------------------
+                    fig_pairs.update_traces(
+                        marker_color=BAR_COLOR,
+                        text=top_pairs_sorted[rank_col],
+                        texttemplate=f"%{{text:{value_format}}}",
+                        textposition="outside",
+                        hovertemplate=(
+                            f"<b>%{{y}}</b><br>{rank_label}: %{{x:{value_format}}}<extra></extra>"
+                        ),
+                    )
 
-with tab_customers:
+                    fig_pairs.update_yaxes(
+                        autorange="reversed",
+                        tickfont=dict(color=BRIGHT_MINT),
+                    )
+                    fig_pairs.update_xaxes(
+                        tickfont=dict(color=BRIGHT_MINT),
+                        title=rank_label,
+                    )
 
-    # GLOBAL repeat rate (correct!)
-    global_visits = df.groupby("customer_hash_id")["order_id"].nunique()
-    global_repeat_rate = (global_visits > 1).mean() * 100
+                    fig_pairs.update_layout(
+                        template=plotly_template,
+                        height=470,  # 🔥 MATCH THE TABLE
+                        margin=dict(l=0, r=20, t=70, b=10),
+                        showlegend=False,
+                    )
 
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>👥 Customer Behavior</h3>",
-        unsafe_allow_html=True,
-    )
+                    # Remove zoom tools (fixes your “bug out” issue)
+                    fig_pairs.update_layout(
+                        dragmode=False
+                    )
 
-    if len(df_filtered):
+                    fig_pairs = clean_axes(fig_pairs)
+                    with st.container():
+                        st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                        st.plotly_chart(
+                            fig_pairs,
+                            use_container_width=True,
+                            config={"displayModeBar": False},  # 🔥 NO ZOOM BAR
+                        )
+                        st.markdown("</div>", unsafe_allow_html=True)
+                # ---- Divider matching Overview tab ----
+                st.markdown("<hr style='opacity:0.25;'>", unsafe_allow_html=True)
+
+                # ----------- CENTERED INSIGHT BOX -----------
+                top_row = pair_rules.iloc[0]
+                pair_count_value = int(top_row["pair_count"])
+
+                st.markdown(
+                    f"""
+                    <div style="
+                        background-color:#111111;
+                        padding:20px;
+                        border-radius:10px;
+                        border:1px solid rgba(255,255,255,0.08);
+                        max-width:1000px;
+                        margin-left:auto;
+                        margin-right:auto;
+                        text-align:center;
+                        line-height:1.6;
+                    ">
+                        <p style="font-size:15px; color:#E8F7F0;">
+                            Customers show strong bundling behavior. The most frequent pairing is
+                            <b>{top_row['category_a']} + {top_row['category_b']}</b>,
+                            appearing together in <b>{pair_count_value:,}</b> orders during the
+                            selected period. These represent ideal opportunities for curated bundle
+                            deals and high-visibility cross-sell prompts at checkout.
+                        </p>
+                    </div>
+                    """,
+                    unsafe_allow_html=True,
+                )
 
-        # FILTERED metrics
-        visits = df_filtered.groupby("customer_hash_id")["order_id"].nunique()
-        avg_visits = visits.mean()
-        customer_count = len(visits)
+            else:
+                st.info("Not enough category diversity to compute bundles for these filters.")
 
-        # KPIs
-        c1, c2, c3 = st.columns(3)
-        c1.metric("Repeat Customer Rate", f"{global_repeat_rate:.1f}%")
-        c2.metric("Average Visits per Customer", f"{avg_visits:.2f}")
-        c3.metric("Customer Count", f"{customer_count:,}")
+            # ---- Product-level bundles ----
+            st.markdown("<hr style='opacity:0.25;'>", unsafe_allow_html=True)
+            st.markdown("**Product Bundles (pairs and triples bought together)**")
+
+            min_bundle_orders = st.slider(
+                "Minimum orders per bundle",
+                min_value=2,
+                max_value=50,
+                step=1,
+                key="min_bundle_orders",
+            )
+            metric_params["min_bundle_orders"] = min_bundle_orders
+            itemsets = metric("product_itemsets")
+
+            if not itemsets.empty:
+                b1, b2 = st.columns(2)
+                for col, size, label in ((b1, 2, "Product Pairs"), (b2, 3, "Product Triples")):
+                    with col:
+                        st.markdown(f"**Top {BUNDLE_TOP_K} {label}**")
+                        sets = itemsets[itemsets["size"] == size]
+                        if sets.empty:
+                            st.info(f"No {label.lower()} reach {min_bundle_orders} orders.")
+                            continue
+                        st.dataframe(
+                            pd.DataFrame({
+                                "Bundle": sets["itemset"],
+                                "Number of Orders": sets["orders"],
+                                "Share of Orders": sets["support"] * 100,
+                            }),
+                            use_container_width=True,
+                            hide_index=True,
+                            column_config=number_columns({
+                                "Number of Orders": "count",
+                                "Share of Orders": "percent_2",
+                            }),
+                        )
+            else:
+                st.info(
+                    f"No product bundles appear in at least {min_bundle_orders} orders "
+                    "for these filters."
+                )
 
-        # ---- VISIT DISTRIBUTION ----
-        visit_counts = visits.value_counts().sort_index()
+        else:
+            st.info("No item data for selected filters.")
 
-        # Bin everything >10 into one bucket
-        over_10 = visit_counts[visit_counts.index > 10].sum()
-        under_11 = visit_counts[visit_counts.index <= 10].copy()
+        card_end()
 
-        # Build display list
-        labels = [str(i) for i in under_11.index]
-        values = list(under_11.values)
 
-        # Add "10+" bucket if needed
-        if over_10 > 0:
-            labels.append("10+")
-            values.append(over_10)
 
-        # Build dataframe
-        df_plot = pd.DataFrame({
-            "visits": pd.Categorical(labels, categories=labels, ordered=True),
-            "count": values,
-        })
+# -----------------------------------------------------------
+# TAB 4 — CUSTOMERS (FINAL FIXED VERSION)
+# -----------------------------------------------------------
 
-        fig_visits = px.bar(
-            df_plot,
-            x="visits",
-            y="count",
-            title="Visit Frequency Distribution (1–10+ Visits)",
-            labels={
-                "visits": "Number of Visits",
-                "count": "Number of Customers",
-            },
-        )
+if tab_customers.open:
+    with tab_customers:
 
-        fig_visits.update_traces(
-            marker_color=PRIMARY_EMERALD,
-            hovertemplate="<b>%{x}</b> visits<br>Customers: %{y:,}<extra></extra>",
-        )
+        # GLOBAL repeat rate (correct!)
+        global_repeat_rate = metric("global_repeat_rate")
 
-        fig_visits.update_xaxes(
-            type="category",              # 🔥 FORCE CATEGORICAL AXIS
-            tickfont=dict(color=BRIGHT_MINT),
-            title="Number of Visits",
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>👥 Customer Behavior</h3>",
+            unsafe_allow_html=True,
         )
 
-        fig_visits.update_yaxes(
-            tickfont=dict(color=BRIGHT_MINT),
-            title="Number of Customers",
-        )
+        if len(df_filtered):
+
+            # FILTERED metrics
+            filtered_visits = metric("filtered_visits")
+            visits = filtered_visits[filtered_visits > 0]
+            avg_visits = visits.mean()
+            customer_count = unique_customers
+
+            # KPIs
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Repeat Customer Rate", f"{global_repeat_rate:.1f}%")
+            c2.metric("Average Visits per Customer", f"{avg_visits:.2f}")
+            c3.metric(
+                "Customer Count",
+                f"{customer_count:,}",
+                help=(
+                    f"HyperLogLog estimate, within about ±{HLL_ERROR:.1%}"
+                    if customers_estimated else None
+                ),
+            )
 
-        fig_visits.update_layout(
-            template=plotly_template,
-            height=420,
-            dragmode=False,
-            modebar_remove=[
-                'zoom', 'pan', 'select', 'lasso', 'zoomin', 'zoomout',
-                'autoscale', 'resetscale'
-            ],
-            margin=dict(l=0, r=0, t=60, b=40),
-        )
+            # ---- VISIT DISTRIBUTION ----
+            customers_per_visits = np.bincount(visits)
+            visit_freq = pd.Series(customers_per_visits)[customers_per_visits > 0]
+
+            # Bin everything >10 into one bucket
+            over_10 = visit_freq[visit_freq.index > 10].sum()
+            under_11 = visit_freq[visit_freq.index <= 10].copy()
+
+            # Build display list
+            labels = [str(i) for i in under_11.index]
+            values = list(under_11.values)
+
+            # Add "10+" bucket if needed
+            if over_10 > 0:
+                labels.append("10+")
+                values.append(over_10)
+
+            # Build dataframe
+            df_plot = pd.DataFrame({
+                "visits": pd.Categorical(labels, categories=labels, ordered=True),
+                "count": values,
+            })
+
+            fig_visits = px.bar(
+                df_plot,
+                x="visits",
+                y="count",
+                title="Visit Frequency Distribution (1–10+ Visits)",
+                labels={
+                    "visits": "Number of Visits",
+                    "count": "Number of Customers",
+                },
+            )
 
-        fig_visits = clean_axes(fig_visits)
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig_visits, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        st.caption("Customers with more than 10 visits are grouped into the ‘10+’ bucket for readability.")
+            fig_visits.update_traces(
+                marker_color=PRIMARY_EMERALD,
+                hovertemplate="<b>%{x}</b> visits<br>Customers: %{y:,}<extra></extra>",
+            )
 
+            fig_visits.update_xaxes(
+                type="category",              # 🔥 FORCE CATEGORICAL AXIS
+                tickfont=dict(color=BRIGHT_MINT),
+                title="Number of Visits",
+            )
 
-    else:
-        st.info("No customer data.")
-    card_end()
+            fig_visits.update_yaxes(
+                tickfont=dict(color=BRIGHT_MINT),
+                title="Number of Customers",
+            )
 
-    # ---------------------------------------------------
-    # TOP CUSTOMERS BY SPEND — FORMATTED WITH NO DECIMALS
-    # ---------------------------------------------------
+            fig_visits.update_layout(
+                template=plotly_template,
+                height=420,
+                dragmode=False,
+                modebar_remove=[
+                    'zoom', 'pan', 'select', 'lasso', 'zoomin', 'zoomout',
+                    'autoscale', 'resetscale'
+                ],
+                margin=dict(l=0, r=0, t=60, b=40),
+            )
 
-    card_start()
-    st.markdown("#### 🥇 Top 20 Customers by Spend")
+            fig_visits = clean_axes(fig_visits)
+            with st.container():
+                st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                st.plotly_chart(fig_visits, use_container_width=True)
+                st.markdown("</div>", unsafe_allow_html=True)
+        
+            st.caption("Customers with more than 10 visits are grouped into the ‘10+’ bucket for readability.")
 
-    if len(df_filtered):
 
-        cs = (
-            df_filtered.groupby("customer_hash_id")
-            .agg(
-                total_spend=("total", "sum"),
-                visits=("order_id", "nunique"),
-            )
-            .reset_index()
-        )
-        cs["avg_ticket"] = cs["total_spend"] / cs["visits"]
+        else:
+            st.info("No customer data.")
+        card_end()
 
-        cs = cs.sort_values("total_spend", ascending=False).head(20).reset_index(drop=True)
+        # ---------------------------------------------------
+        # TOP CUSTOMERS BY SPEND — FORMATTED WITH NO DECIMALS
+        # ---------------------------------------------------
 
-        # Clean display names ("Customer #1", etc.)
-        cs["Customer"] = ["Customer #" + str(i + 1) for i in cs.index]
+        card_start()
+        st.markdown("#### 🥇 Top 20 Customers by Spend")
 
-        # ---- FORMAT MONEY COLUMNS (NO DECIMALS EVER) ----
-        def fmt_whole_dollars(x):
-            return f"${int(round(x)):,}"
+        if len(df_filtered):
 
-        cs["Total Spend ($)"] = cs["total_spend"].apply(fmt_whole_dollars)
-        cs["Average Ticket ($)"] = cs["avg_ticket"].apply(fmt_whole_dollars)
+            cs = metric("top_customers").copy()
 
-        # ---- REORDER COLUMNS ----
-        cs["Number of Visits"] = cs["visits"]
-        cs = cs[["Customer", "Number of Visits", "Total Spend ($)", "Average Ticket ($)"]]
+            # Clean display names ("Customer #1", etc.)
+            cs["Customer"] = ["Customer #" + str(i + 1) for i in cs.index]
 
-        st.dataframe(cs, use_container_width=True, hide_index=True)
+            # ---- MONEY COLUMNS (shown without decimals) ----
+            cs["Total Spend ($)"] = cs["total_spend"]
+            cs["Average Ticket ($)"] = cs["avg_ticket"]
 
-    else:
-        st.info("No customers to display.")
+            # ---- REORDER COLUMNS ----
+            cs["Number of Visits"] = cs["visits"]
+            cs = cs[["Customer", "Number of Visits", "Total Spend ($)", "Average Ticket ($)"]]
+
+            st.dataframe(
+                cs,
+                use_container_width=True,
+                hide_index=True,
+                column_config=number_columns({
+                    "Number of Visits": "count",
+                    "Total Spend ($)": "dollars",
+                    "Average Ticket ($)": "dollars",
+                }),
+            )
+
+        else:
+            st.info("No customers to display.")
 
-    card_end()
+        card_end()
 
 
 # -----------------------------------------------------------
 # TAB 5 — TIME PATTERNS (FULLY UPDATED + MATCHED STYLE)
 # -----------------------------------------------------------
 
-with tab_time:
+if tab_time.open:
+    with tab_time:
 
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>⏱ Ordering Patterns</h3>",
-        unsafe_allow_html=True,
-    )
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>⏱ Ordering Patterns</h3>",
+            unsafe_allow_html=True,
+        )
 
-    if len(df_filtered):
+        if len(df_filtered):
+
+            hour_totals, hour_counts = metric("hour_grid")
+
+            # Weekdays without orders stay blank, as with a groupby
+            weekday_totals = hour_totals.sum(axis=1)
+            weekday_counts = hour_counts.sum(axis=1)
+            has_orders = weekday_counts > 0
+
+            # ================= REVENUE BY DAY OF WEEK =================
+            dow = pd.DataFrame({
+                "weekday": WEEKDAYS,
+                "total": np.where(has_orders, weekday_totals, np.nan),
+            })
+
+            fig_dow = px.bar(
+                dow,
+                x="weekday",
+                y="total",
+                title="Revenue by Day of Week",
+                labels={
+                    "weekday": "Day of Week",
+                    "total": "Revenue ($)",
+                },
+            )
 
-        # ================= REVENUE BY DAY OF WEEK =================
-        dow = (
-            df_filtered.groupby("weekday")["total"]
-            .sum()
-            .reindex(
-                [
-                    "Monday",
-                    "Tuesday",
-                    "Wednesday",
-                    "Thursday",
-                    "Friday",
-                    "Saturday",
-                    "Sunday",
-                ]
+            fig_dow.update_traces(
+                marker_color=PRIMARY_EMERALD,
+                text=[f"${v:,.0f}" for v in dow["total"]],
+                textposition="inside",
+                insidetextfont=dict(color="white"),
+                hovertemplate="<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>",
             )
-            .reset_index()
-        )
 
-        fig_dow = px.bar(
-            dow,
-            x="weekday",
-            y="total",
-            title="Revenue by Day of Week",
-            labels={
-                "weekday": "Day of Week",
-                "total": "Revenue ($)",
-            },
-        )
+            fig_dow.update_xaxes(tickfont=dict(color=BRIGHT_MINT))
+            fig_dow.update_yaxes(tickfont=dict(color=BRIGHT_MINT))
 
-        fig_dow.update_traces(
-            marker_color=PRIMARY_EMERALD,
-            text=[f"${v:,.0f}" for v in dow["total"]],
-            textposition="inside",
-            insidetextfont=dict(color="white"),
-            hovertemplate="<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>",
-        )
+            fig_dow.update_layout(
+                template=plotly_template,
+                height=360,
+                dragmode=False,
+                modebar_remove=[
+                    "zoom","pan","select","lasso","zoomin","zoomout",
+                    "autoscale","resetscale"
+                ],
+                margin=dict(l=0, r=0, t=60, b=40),
+            )
 
-        fig_dow.update_xaxes(tickfont=dict(color=BRIGHT_MINT))
-        fig_dow.update_yaxes(tickfont=dict(color=BRIGHT_MINT))
-
-        fig_dow.update_layout(
-            template=plotly_template,
-            height=360,
-            dragmode=False,
-            modebar_remove=[
-                "zoom","pan","select","lasso","zoomin","zoomout",
-                "autoscale","resetscale"
-            ],
-            margin=dict(l=0, r=0, t=60, b=40),
-        )
+            fig_dow = clean_axes(fig_dow)
 
-        fig_dow = clean_axes(fig_dow)
-
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig_dow, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        # ================= AVERAGE ORDER VALUE BY DAY ================
-        dow_aov = (
-            df_filtered.groupby("weekday")["total"]
-            .mean()
-            .reindex(
-                [
-                    "Monday",
-                    "Tuesday",
-                    "Wednesday",
-                    "Thursday",
-                    "Friday",
-                    "Saturday",
-                    "Sunday",
-                ]
+            with st.container():
+                st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                st.plotly_chart(fig_dow, use_container_width=True)
+                st.markdown("</div>", unsafe_allow_html=True)
+            # ================= AVERAGE ORDER VALUE BY DAY ================
+            dow_aov = pd.DataFrame({
+                "weekday": WEEKDAYS,
+                "total": np.where(has_orders, weekday_totals / np.maximum(weekday_counts, 1), np.nan),
+            })
+
+            fig_aov = px.line(
+                dow_aov,
+                x="weekday",
+                y="total",
+                markers=True,
+                title="Average Order Value by Day of Week",
+                labels={
+                    "weekday": "Day of Week",
+                    "total": "Average Order Value ($)",
+                },
             )
-            .reset_index()
-        )
-
-        fig_aov = px.line(
-            dow_aov,
-            x="weekday",
-            y="total",
-            markers=True,
-            title="Average Order Value by Day of Week",
-            labels={
-                "weekday": "Day of Week",
-                "total": "Average Order Value ($)",
-            },
-        )
 
-        fig_aov.update_traces(
-            line=dict(width=3, color=BRIGHT_MINT),
-            hovertemplate="<b>%{x}</b><br>AOV: $%{y:,.0f}<extra></extra>",
-        )
+            fig_aov.update_traces(
+                line=dict(width=3, color=BRIGHT_MINT),
+                hovertemplate="<b>%{x}</b><br>AOV: $%{y:,.0f}<extra></extra>",
+            )
 
-        fig_aov.update_xaxes(
-            title="Day of Week",
-            tickfont=dict(color=BRIGHT_MINT),
-            range=[-0.05, 6.05],   # even framing
-            fixedrange=True        # disables zoom/drag on X axis
-        )
+            fig_aov.update_xaxes(
+                title="Day of Week",
+                tickfont=dict(color=BRIGHT_MINT),
+                range=[-0.05, 6.05],   # even framing
+                fixedrange=True        # disables zoom/drag on X axis
+            )
 
-        fig_aov.update_yaxes(
-            title="Average Order Value ($)",
-            tickfont=dict(color=BRIGHT_MINT),
-            fixedrange=True        # disables zoom/drag on Y axis too
-        )
+            fig_aov.update_yaxes(
+                title="Average Order Value ($)",
+                tickfont=dict(color=BRIGHT_MINT),
+                fixedrange=True        # disables zoom/drag on Y axis too
+            )
 
-        fig_aov.update_layout(
-            template=plotly_template,
-            height=320,
-            dragmode=False,
-            modebar_remove=[
-                "zoom", "pan", "select", "lasso",
-                "zoomin", "zoomout", "autoscale", "resetscale"
-            ],
-            margin=dict(l=0, r=0, t=60, b=40),
-        )
+            fig_aov.update_layout(
+                template=plotly_template,
+                height=320,
+                dragmode=False,
+                modebar_remove=[
+                    "zoom", "pan", "select", "lasso",
+                    "zoomin", "zoomout", "autoscale", "resetscale"
+                ],
+                margin=dict(l=0, r=0, t=60, b=40),
+            )
 
 
-        fig_aov = clean_axes(fig_aov)
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig_aov, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
+            fig_aov = clean_axes(fig_aov)
+            with st.container():
+                st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                st.plotly_chart(fig_aov, use_container_width=True)
+                st.markdown("</div>", unsafe_allow_html=True)
 
-    else:
-        st.info("No time pattern data.")
-    card_end()
+        else:
+            st.info("No time pattern data.")
+        card_end()
 
 
-    # -----------------------------------------------------------
-    # CLEAN HEATMAP — FIXED COLORS, NO ZOOM, NO FAKE HOVER
-    # -----------------------------------------------------------
+        # -----------------------------------------------------------
+        # CLEAN HEATMAP — FIXED COLORS, NO ZOOM, NO FAKE HOVER
+        # -----------------------------------------------------------
 
-    card_start()
-    if len(df_filtered):
+        card_start()
+        if len(df_filtered):
 
-        hour_dow = (
-            df_filtered.groupby(["weekday", "hour"])["total"]
-            .sum()
-            .reset_index()
-        )
+            hour_order = [
+                "12 AM","1 AM","2 AM","3 AM","4 AM","5 AM",
+                "6 AM","7 AM","8 AM","9 AM","10 AM","11 AM",
+                "12 PM","1 PM","2 PM","3 PM","4 PM","5 PM",
+                "6 PM","7 PM","8 PM","9 PM","10 PM","11 PM",
+            ]
 
-        # Format hour label
-        def format_hour(h):
-            return (
-                "12 AM" if h == 0 else
-                f"{h} AM" if h < 12 else
-                "12 PM" if h == 12 else
-                f"{h-12} PM"
-            )
+            # Hour rows x weekday columns, straight from the grid
+            heat = pd.DataFrame(hour_totals.T, index=hour_order, columns=WEEKDAYS)
 
-        hour_dow["hour_label"] = hour_dow["hour"].apply(format_hour)
+            # Remove rows with all-zero values
+            heat = heat[heat.sum(axis=1) > 0]
 
-        # Pivot
-        heat = hour_dow.pivot(index="hour_label", columns="weekday", values="total")
+            # Replace 0 with NaN so hover doesn't show fake values
+            heat = heat.replace(0, np.nan)
 
-        # Remove rows with all-zero values
-        heat = heat[heat.sum(axis=1) > 0]
+            # Draw heatmap
+            fig_heat = px.imshow(
+                heat,
+                aspect="auto",
+                color_continuous_scale=[
+                    "#dff7e6",  # light mint
+                    "#74d2a2",  # medium mint
+                    PRIMARY_EMERALD  # dark emerald
+                ],
+                title="Revenue Heatmap (Hour of Day × Day of Week)",
+                labels={
+                    "x": "Day of Week",
+                    "y": "Hour of Day",
+                    "color": "Revenue ($)",
+                },
+            )
 
-        # Correct ordering
-        heat = heat.reindex(
-            ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"],
-            axis=1
-        )
+            fig_heat.update_traces(
+                hovertemplate="<b>%{y}</b> on <b>%{x}</b><br>Revenue: $%{z:,.0f}<extra></extra>",
+                hoverongaps=False,  # <-- hides NaN hover!
+            )
 
-        hour_order = [
-            "12 AM","1 AM","2 AM","3 AM","4 AM","5 AM",
-            "6 AM","7 AM","8 AM","9 AM","10 AM","11 AM",
-            "12 PM","1 PM","2 PM","3 PM","4 PM","5 PM",
-            "6 PM","7 PM","8 PM","9 PM","10 PM","11 PM",
-        ]
-        heat = heat.reindex([h for h in hour_order if h in heat.index])
-
-        # Replace 0 with NaN so hover doesn't show fake values
-        heat = heat.replace(0, np.nan)
-
-        # Draw heatmap
-        fig_heat = px.imshow(
-            heat,
-            aspect="auto",
-            color_continuous_scale=[
-                "#dff7e6",  # light mint
-                "#74d2a2",  # medium mint
-                PRIMARY_EMERALD  # dark emerald
-            ],
-            title="Revenue Heatmap (Hour of Day × Day of Week)",
-            labels={
-                "x": "Day of Week",
-                "y": "Hour of Day",
-                "color": "Revenue ($)",
-            },
-        )
+            fig_heat.update_layout(
+                template=plotly_template,
+                height=420,
+                dragmode=False,
+                modebar_remove=[
+                    'zoom','pan','select','lasso','zoomin','zoomout',
+                    'autoscale','resetscale'
+                ],
+                margin=dict(l=0, r=0, t=60, b=40),
+            )
 
-        fig_heat.update_traces(
-            hovertemplate="<b>%{y}</b> on <b>%{x}</b><br>Revenue: $%{z:,.0f}<extra></extra>",
-            hoverongaps=False,  # <-- hides NaN hover!
-        )
+            fig_heat = clean_axes(fig_heat)
+            with st.container():
+                st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                st.plotly_chart(fig_heat, use_container_width=True)
+                st.markdown("</div>", unsafe_allow_html=True)
+            # ---------------------------------------
+            # WEEKDAY VS WEEKEND SUMMARY — KPIs
+            # ---------------------------------------
+            st.markdown("---")
+            st.markdown("#### Weekday vs Weekend Summary")
+
+            def block_summary(weekdays, label):
+                orders = int(weekday_counts[weekdays].sum())
+                aov = weekday_totals[weekdays].sum() / orders if orders else 0
+                return label, orders, aov
+
+            summaries = [
+                block_summary(slice(0, 4), "Mon–Thu (Weekdays)"),
+                block_summary(slice(4, 6), "Fri–Sat (Stock-Up Days)"),
+                block_summary(slice(6, 7), "Sunday"),
+            ]
 
-        fig_heat.update_layout(
-            template=plotly_template,
-            height=420,
-            dragmode=False,
-            modebar_remove=[
-                'zoom','pan','select','lasso','zoomin','zoomout',
-                'autoscale','resetscale'
-            ],
-            margin=dict(l=0, r=0, t=60, b=40),
-        )
+            c1, c2, c3 = st.columns(3)
+            for col, (label, orders, aov) in zip([c1, c2, c3], summaries):
+                with col:
+                    st.metric(label, f"{orders:,} orders", f"AOV ${aov:,.0f}")
 
-        fig_heat = clean_axes(fig_heat)
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig_heat, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        # ---------------------------------------
-        # WEEKDAY VS WEEKEND SUMMARY — KPIs
-        # ---------------------------------------
-        st.markdown("---")
-        st.markdown("#### Weekday vs Weekend Summary")
-
-        def block_summary(mask, label):
-            block = df_filtered[mask]
-            orders = block["order_id"].nunique()
-            aov = block["total"].mean() if len(block) else 0
-            return label, orders, aov
-
-        mon_thu = df_filtered["weekday"].isin(["Monday","Tuesday","Wednesday","Thursday"])
-        fri_sat = df_filtered["weekday"].isin(["Friday","Saturday"])
-        sunday = df_filtered["weekday"].isin(["Sunday"])
-
-        summaries = [
-            block_summary(mon_thu, "Mon–Thu (Weekdays)"),
-            block_summary(fri_sat, "Fri–Sat (Stock-Up Days)"),
-            block_summary(sunday, "Sunday"),
-        ]
-
-        c1, c2, c3 = st.columns(3)
-        for col, (label, orders, aov) in zip([c1, c2, c3], summaries):
-            with col:
-                st.metric(label, f"{orders:,} orders", f"AOV ${aov:,.0f}")
-
-    card_end()
+        card_end()
 
 
 # -----------------------------------------------------------
 # TAB 6 — PROFITABILITY (CLEAN + CONSISTENT + UPDATED)
 # -----------------------------------------------------------
 
-with tab_profit:
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>💵 Profitability Overview</h3>",
-        unsafe_allow_html=True,
-    )
+if tab_profit.open:
+    with tab_profit:
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>💵 Profitability Overview</h3>",
+            unsafe_allow_html=True,
+        )
 
-    if len(items_filtered):
-        # Use existing helper (keeps your margin model exactly the same)
-        items_profit = enrich_with_profit(items_filtered)
+        if len(items_filtered):
+            # Category margin model, applied to the window aggregates
+            profit_summary = metric("profit_summary")
+            margins = metric("margins")
 
-        # -----------------------------
-        # HIGH-LEVEL KPIs (cleaned)
-        # -----------------------------
-        # Align profitability with KPI card totals
-        total_net_sales = df_filtered["total"].sum()
+            # -----------------------------
+            # HIGH-LEVEL KPIs (cleaned)
+            # -----------------------------
+            # Align profitability with KPI card totals
+            total_net_sales = df_filtered["total"].sum()
 
-        total_est_profit = items_profit["est_gross_profit"].sum()
+            total_est_profit = profit_summary["profit"]
 
-        overall_margin = (
-            (total_est_profit / total_net_sales) * 100
-            if total_net_sales > 0 else 0
-        )
+            overall_margin = (
+                (total_est_profit / total_net_sales) * 100
+                if total_net_sales > 0 else 0
+            )
 
-        c1, c2, c3 = st.columns(3)
-        c1.metric("Net Sales (Tracked Items)", f"${total_net_sales:,.2f}")
-        c2.metric("Estimated Gross Profit", f"${total_est_profit:,.2f}")
-        c3.metric("Estimated Gross Margin", f"{overall_margin:,.1f}%")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Net Sales (Tracked Items)", f"${total_net_sales:,.2f}")
+            c2.metric("Estimated Gross Profit", f"${total_est_profit:,.2f}")
+            c3.metric("Estimated Gross Margin", f"{overall_margin:,.1f}%")
 
-        st.caption("Margins are approximate category assumptions for internal visibility.")
-        st.markdown("---")
+            st.caption("Margins are approximate category assumptions for internal visibility.")
+            st.markdown("---")
 
-        # -----------------------------------------------------------
-        # CATEGORY PROFITABILITY (CLEAN + FIXED)
-        # -----------------------------------------------------------
+            # -----------------------------------------------------------
+            # CATEGORY PROFITABILITY (CLEAN + FIXED)
+            # -----------------------------------------------------------
 
-        # 1. NUMERIC version for calculations + bar chart
-        cat_profit = (
-            items_profit.groupby("category")
-            .agg(
-                net_sales=("net_sales", "sum"),
-                profit=("est_gross_profit", "sum"),
-                units=("total_inventory_sold", "sum"),
-                orders=("order_id", "nunique"),
+            # 1. NUMERIC version for calculations + bar chart
+            cat_profit = category_totals[["category", "net_sales", "units", "orders"]].copy()
+            cat_profit["profit"] = (
+                category_totals["net_sales"]
+                * margins[category_totals["code"]]
             )
-            .reset_index()
-        )
 
-        cat_profit["margin_pct"] = (cat_profit["profit"] / cat_profit["net_sales"]) * 100
-        cat_profit["profit_per_unit"] = cat_profit["profit"] / cat_profit["units"]
-        cat_profit["profit_per_order"] = cat_profit["profit"] / cat_profit["orders"]
-
-        # Keep a clean numeric copy for charts
-        cat_profit_chart = cat_profit.copy()
-
-        # 2. FORMATTED version for table
-        cat_profit_display = cat_profit.rename(
-            columns={
-                "category": "Category",
-                "net_sales": "Net Sales ($)",
-                "profit": "Estimated Profit ($)",
-                "units": "Units Sold",
-                "orders": "Orders",
-                "margin_pct": "Margin (%)",
-                "profit_per_unit": "Profit per Unit ($)",
-                "profit_per_order": "Profit per Order ($)",
-            }
-        )
+            cat_profit["margin_pct"] = (cat_profit["profit"] / cat_profit["net_sales"]) * 100
+            cat_profit["profit_per_unit"] = cat_profit["profit"] / cat_profit["units"]
+            cat_profit["profit_per_order"] = cat_profit["profit"] / cat_profit["orders"]
+
+            # Keep a clean numeric copy for charts
+            cat_profit_chart = cat_profit.copy()
+
+            # 2. FORMATTED version for table
+            cat_profit_display = cat_profit.rename(
+                columns={
+                    "category": "Category",
+                    "net_sales": "Net Sales ($)",
+                    "profit": "Estimated Profit ($)",
+                    "units": "Units Sold",
+                    "orders": "Orders",
+                    "margin_pct": "Margin (%)",
+                    "profit_per_unit": "Profit per Unit ($)",
+                    "profit_per_order": "Profit per Order ($)",
+                }
+            )
+
+            # Reorder columns for table
+            cat_profit_display = cat_profit_display[
+                [
+                    "Category",
+                    "Orders",
+                    "Units Sold",
+                    "Profit per Unit ($)",
+                    "Profit per Order ($)",
+                    "Net Sales ($)",
+                    "Estimated Profit ($)",
+                    "Margin (%)",
+                ]
+            ]
+
+            # Sort by estimated profit
+            cat_profit_display = cat_profit_display.sort_values(
+                "Estimated Profit ($)", ascending=False
+            )
 
-        # Reorder columns for table
-        cat_profit_display = cat_profit_display[
-            [
-                "Category",
-                "Orders",
-                "Units Sold",
+            # -----------------------------
+            # COLUMN FORMATS (money, margin, commas on orders + units)
+            # -----------------------------
+            money_cols = [
                 "Profit per Unit ($)",
                 "Profit per Order ($)",
                 "Net Sales ($)",
                 "Estimated Profit ($)",
-                "Margin (%)",
             ]
-        ]
+            cat_profit_formats = number_columns({
+                **{col: "dollars" for col in money_cols},
+                "Margin (%)": "percent",
+                "Orders": "count",
+                "Units Sold": "number",
+            })
+
+            # --------------------
+            # RENDER TABLE + CHART
+            # --------------------
+            c1, c2 = st.columns([1.4, 1.6])
 
-        # Sort by estimated profit
-        cat_profit_display = cat_profit_display.sort_values(
-            "Estimated Profit ($)", ascending=False
-        )
+            with c1:
+                st.markdown("**Category Profitability**")
+                st.dataframe(
+                    cat_profit_display,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config=cat_profit_formats,
+                )
 
-        # -----------------------------
-        # FORMAT MONEY COLUMNS
-        # -----------------------------
-        money_cols = [
-            "Profit per Unit ($)",
-            "Profit per Order ($)",
-            "Net Sales ($)",
-            "Estimated Profit ($)",
-        ]
-
-        for col in money_cols:
-            cat_profit_display[col] = cat_profit_display[col].apply(
-                lambda x: f"${x:,.0f}"
-            )
+            with c2:
 
-        # Margin formatting
-        cat_profit_display["Margin (%)"] = cat_profit_display["Margin (%)"].apply(
-            lambda x: f"{x:,.1f}%"
-        )
+                # ❗ Fix: sort FIRST and store result so labels match bars
+                chart_data = cat_profit_chart.sort_values("profit", ascending=True)
 
-        # -----------------------------
-        # ADD COMMAS TO ORDERS + UNITS
-        # -----------------------------
-        cat_profit_display["Orders"] = cat_profit_display["Orders"].apply(
-            lambda x: f"{x:,}"
-        )
+                fig_cat_profit = px.bar(
+                    chart_data,
+                    x="profit",
+                    y="category",
+                    orientation="h",
+                    title="Estimated Profit by Category",
+                    labels={"profit": "Estimated Profit ($)", "category": "Category"},
+                    color="profit",
+                    color_continuous_scale=[MINT, PRIMARY_EMERALD],
+                )
+
+                # ❗ Fix: use chart_data (sorted) for labels, not cat_profit_chart
+                fig_cat_profit.update_traces(
+                    hovertemplate="<b>%{y}</b><br>Profit: $%{x:,.0f}<extra></extra>",
+                    text=chart_data["profit"].round(0),
+                    texttemplate="$%{text:,}",
+                    textposition="outside"
+                )
+
+                fig_cat_profit.update_layout(
+                    template=plotly_template,
+                    height=500,
+                    modebar_remove=[
+                        'zoom','pan','select','lasso','zoomin','zoomout',
+                        'autoscale','resetscale'
+                    ],
+                    margin=dict(l=20, r=90, t=60, b=20)   # ← more breathing room on right
+                )
+
+                fig_cat_profit.update_traces(
+                    cliponaxis=False                      # ← prevents label clipping
+                )
 
-        cat_profit_display["Units Sold"] = cat_profit_display["Units Sold"].apply(
-            lambda x: f"{x:,}"
-        )
 
-        # --------------------
-        # RENDER TABLE + CHART
-        # --------------------
-        c1, c2 = st.columns([1.4, 1.6])
+                fig_cat_profit = clean_axes(fig_cat_profit)
+                fig_cat_profit = force_gradient_colors(fig_cat_profit)
+                with st.container():
+                    st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
+                    st.plotly_chart(fig_cat_profit, use_container_width=True)
+                    st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown("---")
+
+            # =======================================================
+            # PRODUCT-LEVEL PROFITABILITY
+            # =======================================================
+            # Top 15 from the daily product rows, reusing the Products tab arrays
+            product_daily = get_aggregate(data, "product_daily")
+            product_totals = product_window(
+                product_daily,
+                start_day,
+                end_day,
+                category_totals["code"].to_numpy(),
+                margins,
+            )
+            top = top_k(product_totals["profit"], product_totals["lines"] > 0, 15)
+            prod_profit = pd.DataFrame({
+                "product_name": product_daily["products"][top],
+                "net_sales": product_totals["net_sales"][top],
+                "profit": product_totals["profit"][top],
+                "units": product_totals["units"][top],
+            })
+
+            prod_profit["margin_pct"] = np.where(
+                prod_profit["net_sales"] > 0,
+                (prod_profit["profit"] / prod_profit["net_sales"]) * 100,
+                0
+            )
 
-        with c1:
-            st.markdown("**Category Profitability**")
-            st.dataframe(cat_profit_display, use_container_width=True, hide_index=True)
+            prod_profit_display = prod_profit.rename(
+                columns={
+                    "product_name": "Product Name",
+                    "net_sales": "Net Sales ($)",
+                    "profit": "Estimated Profit ($)",
+                    "units": "Units Sold",
+                    "margin_pct": "Margin (%)",
+                }
+            )
 
-        with c2:
+            # Sort for “Top 15” chart before formatting
+            top_15 = prod_profit_display.sort_values(
+                "Estimated Profit ($)", ascending=False
+            ).head(15)
 
-            # ❗ Fix: sort FIRST and store result so labels match bars
-            chart_data = cat_profit_chart.sort_values("profit", ascending=True)
+            st.markdown("#### Top 15 Products by Estimated Profit")
 
-            fig_cat_profit = px.bar(
-                chart_data,
-                x="profit",
-                y="category",
+            fig_top = px.bar(
+                top_15,
+                x="Estimated Profit ($)",
+                y="Product Name",
                 orientation="h",
-                title="Estimated Profit by Category",
-                labels={"profit": "Estimated Profit ($)", "category": "Category"},
-                color="profit",
+                color="Estimated Profit ($)",
                 color_continuous_scale=[MINT, PRIMARY_EMERALD],
+                title="Top 15 Products by Estimated Profit",
             )
 
-            # ❗ Fix: use chart_data (sorted) for labels, not cat_profit_chart
-            fig_cat_profit.update_traces(
-                hovertemplate="<b>%{y}</b><br>Profit: $%{x:,.0f}<extra></extra>",
-                text=chart_data["profit"].round(0),
-                texttemplate="$%{text:,}",
-                textposition="outside"
+            fig_top.update_traces(
+                text=top_15["Estimated Profit ($)"],
+                texttemplate="$%{text:,.0f}",
+                textposition="outside",
+                cliponaxis=False,
+                hovertemplate="<b>%{y}</b><br>Estimated Profit: $%{x:,.0f}<extra></extra>",
             )
 
-            fig_cat_profit.update_layout(
+
+            # --- Layout improvements (more margin on right) ---
+            fig_top.update_layout(
                 template=plotly_template,
-                height=500,
+                height=450,
+                margin=dict(l=20, r=90, t=60, b=40),   # ← more breathing room
                 modebar_remove=[
                     'zoom','pan','select','lasso','zoomin','zoomout',
                     'autoscale','resetscale'
-                ],
-                margin=dict(l=20, r=90, t=60, b=20)   # ← more breathing room on right
+                ]
             )
 
-            fig_cat_profit.update_traces(
-                cliponaxis=False                      # ← prevents label clipping
-            )
+            # --- Keep best visual order (highest at top) ---
+            fig_top.update_yaxes(autorange="reversed")
 
+            # --- Apply your color gradient helper ---
+            fig_top = clean_axes(fig_top)
+            fig_top = force_gradient_colors(fig_top)
 
-            fig_cat_profit = clean_axes(fig_cat_profit)
-            fig_cat_profit = force_gradient_colors(fig_cat_profit)
             with st.container():
                 st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-                st.plotly_chart(fig_cat_profit, use_container_width=True)
+                st.plotly_chart(fig_top, use_container_width=True)
                 st.markdown("</div>", unsafe_allow_html=True)
-
-        st.markdown("---")
-
-        # =======================================================
-        # PRODUCT-LEVEL PROFITABILITY
-        # =======================================================
-        prod_profit = (
-            items_profit.groupby("product_name")
-            .agg(
-                net_sales=("net_sales", "sum"),
-                profit=("est_gross_profit", "sum"),
-                units=("total_inventory_sold", "sum"),
+            # =======================================================
+            # VENDOR-LEVEL PROFITABILITY
+            # =======================================================
+            vendor = profit_summary["vendors"].copy()
+
+            vendor["margin_pct"] = np.where(
+                vendor["net_sales"] > 0,
+                (vendor["profit"] / vendor["net_sales"]) * 100,
+                0
             )
-            .reset_index()
-        )
-
-        prod_profit["margin_pct"] = np.where(
-            prod_profit["net_sales"] > 0,
-            (prod_profit["profit"] / prod_profit["net_sales"]) * 100,
-            0
-        )
 
-        prod_profit_display = prod_profit.rename(
-            columns={
-                "product_name": "Product Name",
-                "net_sales": "Net Sales ($)",
-                "profit": "Estimated Profit ($)",
-                "units": "Units Sold",
-                "margin_pct": "Margin (%)",
-            }
-        )
-
-        # Sort for “Top 15” chart before formatting
-        top_15 = prod_profit_display.sort_values(
-            "Estimated Profit ($)", ascending=False
-        ).head(15)
-
-        st.markdown("#### Top 15 Products by Estimated Profit")
-
-        fig_top = px.bar(
-            top_15,
-            x="Estimated Profit ($)",
-            y="Product Name",
-            orientation="h",
-            color="Estimated Profit ($)",
-            color_continuous_scale=[MINT, PRIMARY_EMERALD],
-            title="Top 15 Products by Estimated Profit",
-        )
+            vendor_display = vendor.rename(
+                columns={
+                    "vendor_name": "Vendor",
+                    "net_sales": "Net Sales ($)",
+                    "profit": "Estimated Profit ($)",
+                    "margin_pct": "Margin (%)",
+                }
+            ).sort_values("Estimated Profit ($)", ascending=False)
+
+            st.markdown("#### Vendor Profitability Overview")
+            st.dataframe(
+                vendor_display.head(25),
+                hide_index=True,
+                use_container_width=True,
+                column_config=number_columns({
+                    "Net Sales ($)": "dollars",
+                    "Estimated Profit ($)": "dollars",
+                    "Margin (%)": "percent",
+                }),
+            )
 
-        fig_top.update_traces(
-            text=top_15["Estimated Profit ($)"],
-            texttemplate="$%{text:,.0f}",
-            textposition="outside",
-            cliponaxis=False,
-            hovertemplate="<b>%{y}</b><br>Estimated Profit: $%{x:,.0f}<extra></extra>",
-        )
+            # =======================================================
+            # WHAT-IF MARGIN SCENARIOS
+            # =======================================================
+            st.markdown("---")
+            st.markdown("#### What-if Margin Scenarios")
+            st.caption(
+                "Edit a scenario's margins (e.g. one category at 0.55) to reprice the "
+                "selected range. Scenarios are compared side by side with the current margins."
+            )
 
+            # One row per category label, so edits survive filter changes;
+            # earlier edits are restored after another tab was open
+            scenario_categories = product_daily["categories"]
+            scenario_input = pd.DataFrame({"Category": scenario_categories, "Current": margins[:-1]})
+            scenario_values = st.session_state.get("margin_scenario_values", {})
+            for name in SCENARIO_NAMES:
+                scenario_input[name] = (
+                    scenario_input["Category"].map(scenario_values.get(name, {}))
+                    .astype(float)
+                    .fillna(scenario_input["Current"])
+                )
+            scenario_edit = st.data_editor(
+                scenario_input,
+                key="margin_scenarios",
+                hide_index=True,
+                use_container_width=True,
+                disabled=["Category", "Current"],
+                column_config={
+                    name: st.column_config.NumberColumn(
+                        min_value=0.0, max_value=1.0, step=0.01, format="%.2f"
+                    )
+                    for name in ("Current",) + SCENARIO_NAMES
+                },
+            )
 
-        # --- Layout improvements (more margin on right) ---
-        fig_top.update_layout(
-            template=plotly_template,
-            height=450,
-            margin=dict(l=20, r=90, t=60, b=40),   # ← more breathing room
-            modebar_remove=[
-                'zoom','pan','select','lasso','zoomin','zoomout',
-                'autoscale','resetscale'
-            ]
-        )
+            # Cleared cells fall back to the current margin
+            metric_params["margin_scenarios"] = {
+                name: {
+                    "margins": dict(zip(
+                        scenario_categories,
+                        scenario_edit[name].fillna(scenario_edit["Current"]).astype(float),
+                    )),
+                    "default": metric_params["margin_table"]["default"],
+                }
+                for name in ("Current",) + SCENARIO_NAMES
+            }
+            st.session_state.margin_scenario_values = {
+                name: metric_params["margin_scenarios"][name]["margins"] for name in SCENARIO_NAMES
+            }
+            scenario_names = list(metric_params["margin_scenarios"])
+            scenario_profit = metric("scenario_profit")
+            sales_basis = metric("sales_basis")
+
+            def scenario_leaders(by):
+                group, labels = SCENARIO_RANKINGS[by]
+                present = sales_basis[f"{group}_lines"] > 0
+                return [
+                    product_daily[labels][top_k(scenario_profit[group][:, i], present, 1)].item()
+                    for i in range(len(scenario_names))
+                ]
 
-        # --- Keep best visual order (highest at top) ---
-        fig_top.update_yaxes(autorange="reversed")
-
-        # --- Apply your color gradient helper ---
-        fig_top = clean_axes(fig_top)
-        fig_top = force_gradient_colors(fig_top)
-
-        with st.container():
-            st.markdown("<div class='chart-scroll'>", unsafe_allow_html=True)
-            st.plotly_chart(fig_top, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        # =======================================================
-        # VENDOR-LEVEL PROFITABILITY
-        # =======================================================
-        vendor = (
-            items_profit.groupby("vendor_name")
-            .agg(
-                net_sales=("net_sales", "sum"),
-                profit=("est_gross_profit", "sum"),
+            scenario_totals = scenario_profit["category"].sum(axis=0)
+            scenario_summary = pd.DataFrame({
+                "Scenario": scenario_names,
+                "Estimated Profit ($)": scenario_totals,
+                "Change vs Current ($)": scenario_totals - scenario_totals[0],
+                "Margin (%)": (
+                    scenario_totals / total_net_sales * 100 if total_net_sales > 0 else 0.0
+                ),
+            })
+            for by in SCENARIO_RANKINGS:
+                scenario_summary[f"Top {by}"] = scenario_leaders(by)
+
+            st.dataframe(
+                scenario_summary,
+                hide_index=True,
+                use_container_width=True,
+                column_config=number_columns({
+                    "Estimated Profit ($)": "dollars",
+                    "Change vs Current ($)": "dollars",
+                    "Margin (%)": "percent",
+                }),
             )
-            .reset_index()
-        )
-
-        vendor["margin_pct"] = np.where(
-            vendor["net_sales"] > 0,
-            (vendor["profit"] / vendor["net_sales"]) * 100,
-            0
-        )
 
-        vendor_display = vendor.rename(
-            columns={
-                "vendor_name": "Vendor",
-                "net_sales": "Net Sales ($)",
-                "profit": "Estimated Profit ($)",
-                "margin_pct": "Margin (%)",
-            }
-        ).sort_values("Estimated Profit ($)", ascending=False)
-
-        # Clean formatting
-        vendor_display["Net Sales ($)"] = vendor_display["Net Sales ($)"].apply(lambda x: f"${x:,.0f}")
-        vendor_display["Estimated Profit ($)"] = vendor_display["Estimated Profit ($)"].apply(lambda x: f"${x:,.0f}")
-        vendor_display["Margin (%)"] = vendor_display["Margin (%)"].apply(lambda x: f"{x:.1f}%")
-
-        st.markdown("#### Vendor Profitability Overview")
-        st.dataframe(
-            vendor_display.head(25),
-            hide_index=True,
-            use_container_width=True,
-        )
+            ranking_by = st.selectbox(
+                "Compare scenario rankings by",
+                options=list(SCENARIO_RANKINGS),
+                key="scenario_ranking",
+            )
+            group, labels = SCENARIO_RANKINGS[ranking_by]
+            group_profit = scenario_profit[group]
+            present = sales_basis[f"{group}_lines"] > 0
+
+            # Every scenario's top 10, in current-margin order
+            shown = np.unique(np.concatenate([
+                top_k(group_profit[:, i], present, 10) for i in range(len(scenario_names))
+            ]))
+            shown = shown[np.argsort(-group_profit[shown, 0], kind="stable")]
+            ranked = np.where(present[:, None], group_profit, -np.inf)
+
+            scenario_ranking = pd.DataFrame({ranking_by: product_daily[labels][shown]})
+            ranking_formats = {}
+            for i, name in enumerate(scenario_names):
+                scenario_ranking[f"{name} ($)"] = group_profit[shown, i]
+                scenario_ranking[f"{name} Rank"] = rank_desc(ranked[:, i])[shown]
+                ranking_formats[f"{name} ($)"] = "dollars"
+                ranking_formats[f"{name} Rank"] = "count"
+
+            st.dataframe(
+                scenario_ranking,
+                hide_index=True,
+                use_container_width=True,
+                column_config=number_columns(ranking_formats),
+            )
 
-    else:
-        st.info("No item data available for the selected filters.")
+        else:
+            st.info("No item data available for the selected filters.")
 
-    card_end()
+        card_end()
 
 
 
@@ -1889,118 +3781,116 @@ with tab_profit:
 # TAB 7 — INSIGHTS (REWRITTEN + CLEAN + ADAPTIVE)
 # -----------------------------------------------------------
 
-with tab_insights:
+if tab_insights.open:
+    with tab_insights:
 
-    card_start()
-    st.markdown(
-        f"<h3 style='color:{BRIGHT_MINT};'>💡 Key Insights</h3>",
-        unsafe_allow_html=True,
-    )
+        card_start()
+        st.markdown(
+            f"<h3 style='color:{BRIGHT_MINT};'>💡 Key Insights</h3>",
+            unsafe_allow_html=True,
+        )
 
-    if len(df_filtered) and len(items_filtered):
+        if len(df_filtered) and len(items_filtered):
 
-        # BASIC METRICS
-        total_orders = df_filtered["order_id"].nunique()
-        avg_orders_per_day = total_orders / max((end_date - start_date).days + 1, 1)
-        # Repeat rate (MATCH KPI)
-        df_date_range = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-        visits = df_date_range.groupby("customer_hash_id")["order_id"].nunique()
-        repeat_rate_local = (visits > 1).mean() * 100
+            # BASIC METRICS
+            total_orders = df_filtered["order_id"].nunique()
+            avg_orders_per_day = total_orders / max((end_date - start_date).days + 1, 1)
+            # Repeat rate (MATCH KPI)
+            repeat_rate_local = metric("repeat_rate")
 
 
-        # CATEGORY MIX
-        category_revenue = items_filtered.groupby("category")["net_sales"].sum()
-        if not category_revenue.empty:
-            top_category = category_revenue.idxmax()
-            top_share = (category_revenue.max() / category_revenue.sum()) * 100
-        else:
-            top_category = "N/A"
-            top_share = 0
+            # CATEGORY MIX
+            category_revenue = metric("category_revenue")
+            if not category_revenue.empty:
+                top_category = category_revenue.idxmax()
+                top_share = (category_revenue.max() / category_revenue.sum()) * 100
+            else:
+                top_category = "N/A"
+                top_share = 0
 
-        all_selected = set(selected_categories) == set(all_categories)
-        single_category = len(selected_categories) == 1
+            all_selected = set(selected_categories) == set(all_categories)
+            single_category = len(selected_categories) == 1
 
-        if single_category:
-            category_mix_sentence = (
-                f"{top_category} leads with 100% of category revenue, "
-                f"as it is the only category selected."
-            )
-        else:
-            category_mix_sentence = (
-                f"{top_category} leads with {top_share:.1f}% of category revenue, "
-                "indicating where merchandising and inventory decisions matter most."
-            )
+            if single_category:
+                category_mix_sentence = (
+                    f"{top_category} leads with 100% of category revenue, "
+                    f"as it is the only category selected."
+                )
+            else:
+                category_mix_sentence = (
+                    f"{top_category} leads with {top_share:.1f}% of category revenue, "
+                    "indicating where merchandising and inventory decisions matter most."
+                )
 
-        # BUNDLING
-        pair_df_ins = compute_category_pairs(items_filtered[["order_id", "category"]])
+            # BUNDLING
+            pair_df_ins = metric("pair_df")
 
-        if single_category or pair_df_ins.empty:
-            bundling_sentence = (
-                "The most common cross-category pairing is N/A, since only a single "
-                "category was selected or no qualifying bundles exist."
-            )
-        else:
-            top_pair = pair_df_ins.iloc[0]
+            if single_category or pair_df_ins.empty:
+                bundling_sentence = (
+                    "The most common cross-category pairing is N/A, since only a single "
+                    "category was selected or no qualifying bundles exist."
+                )
+            else:
+                top_pair = pair_df_ins.iloc[0]
+
+                # SAFELY CONVERT pair_count
+                pair_count_value = pd.to_numeric(top_pair["pair_count"], errors="coerce")
+                pair_count_value = 0 if pd.isna(pair_count_value) else int(pair_count_value)
+
+                bundling_sentence = (
+                    f"The most common cross-category pairing is "
+                    f"<b>{top_pair['category_a']} + {top_pair['category_b']}</b>, "
+                    f"appearing together in <b>{pair_count_value:,}</b> orders. "
+                    "This represents a strong ready-made bundle opportunity."
+                )
 
-            # SAFELY CONVERT pair_count
-            pair_count_value = pd.to_numeric(top_pair["pair_count"], errors="coerce")
-            pair_count_value = 0 if pd.isna(pair_count_value) else int(pair_count_value)
 
-            bundling_sentence = (
-                f"The most common cross-category pairing is "
-                f"<b>{top_pair['category_a']} + {top_pair['category_b']}</b>, "
-                f"appearing together in <b>{pair_count_value:,}</b> orders. "
-                "This represents a strong ready-made bundle opportunity."
+            # PROFITABILITY
+            total_est_profit = metric("profit_summary")["profit"]
+            # Use the SAME KPI total so Insights matches the cards
+            total_net_sales = total_revenue
+            margin_insights = (
+                (total_est_profit / total_net_sales) * 100 if total_net_sales > 0 else 0
             )
 
+            # LOYALTY
+            if all_selected:
+                loyalty_sentence = (
+                    f"{repeat_rate_local:.1f}% of customers are repeat buyers, "
+                    "forming a strong base for retention programs."
+                )
+            else:
+                loyalty_sentence = (
+                    f"{repeat_rate_local:.1f}% of customers within these filters are repeat buyers. "
+                    "This differs from overall storewide behavior, revealing how loyalty varies "
+                    "across categories."
+                )
 
-        # PROFITABILITY
-        items_profit_ins = enrich_with_profit(items_filtered)
-        total_est_profit = items_profit_ins["est_gross_profit"].sum()
-        # Use the SAME KPI total so Insights matches the cards
-        total_net_sales = total_revenue
-        margin_insights = (
-            (total_est_profit / total_net_sales) * 100 if total_net_sales > 0 else 0
-        )
-
-        # LOYALTY
-        if all_selected:
-            loyalty_sentence = (
-                f"{repeat_rate_local:.1f}% of customers are repeat buyers, "
-                "forming a strong base for retention programs."
-            )
-        else:
-            loyalty_sentence = (
-                f"{repeat_rate_local:.1f}% of customers within these filters are repeat buyers. "
-                "This differs from overall storewide behavior, revealing how loyalty varies "
-                "across categories."
-            )
-
-        st.markdown(f"""
-        <ul style="list-style-type: disc; padding-left: 20px; font-size:16px; color:#E8F7F0;">
+            st.markdown(f"""
+            <ul style="list-style-type: disc; padding-left: 20px; font-size:16px; color:#E8F7F0;">
 
-        <li><b>Overall performance:</b> ${total_net_sales:,.2f} over <b>{total_orders:,}</b> orders ({avg_orders_per_day:.1f} per day).</li>
+            <li><b>Overall performance:</b> ${total_net_sales:,.2f} over <b>{total_orders:,}</b> orders ({avg_orders_per_day:.1f} per day).</li>
 
-        <li><b>Customer loyalty:</b> {loyalty_sentence}</li>
+            <li><b>Customer loyalty:</b> {loyalty_sentence}</li>
 
-        <li><b>Basket health:</b> Customers spend an average of <b>${avg_order:,.2f}</b> with ~<b>{avg_items_order:.2f}</b> items per order, supporting bundle and upsell strategies.</li>
+            <li><b>Basket health:</b> Customers spend an average of <b>${avg_order:,.2f}</b> with ~<b>{avg_items_order:.2f}</b> items per order, supporting bundle and upsell strategies.</li>
 
-        <li><b>Category mix:</b> {category_mix_sentence}</li>
+            <li><b>Category mix:</b> {category_mix_sentence}</li>
 
-        <li><b>Bundling:</b> {bundling_sentence}</li>
+            <li><b>Bundling:</b> {bundling_sentence}</li>
 
-        <li><b>Profitability:</b> Estimated gross margin on item sales is <b>{margin_insights:.1f}%</b>, with total estimated gross profit of <b>${total_est_profit:,.2f}</b> across the selected range.</li>
+            <li><b>Profitability:</b> Estimated gross margin on item sales is <b>{margin_insights:.1f}%</b>, with total estimated gross profit of <b>${total_est_profit:,.2f}</b> across the selected range.</li>
 
-        </ul>
+            </ul>
 
-        <p style="font-size:14px; margin-top:10px; color:#E8F7F0; max-width:900px;">
-        Use these insights to tune promotions, bundles, staffing, inventory, and retention plays for the selected date range.
-        </p>
-        """, unsafe_allow_html=True)
+            <p style="font-size:14px; margin-top:10px; color:#E8F7F0; max-width:900px;">
+            Use these insights to tune promotions, bundles, staffing, inventory, and retention plays for the selected date range.
+            </p>
+            """, unsafe_allow_html=True)
 
 
-    else:
-        st.info("Not enough data to generate insights. Try widening the date range or relaxing filters.")
+        else:
+            st.info("Not enough data to generate insights. Try widening the date range or relaxing filters.")
 
-    card_end()
+        card_end()
 
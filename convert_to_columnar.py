@@ -0,0 +1,157 @@
+"""
+Typed columnar copies of the dashboard's source tables.
+
+The dashboard can read orders and items from Parquet or Arrow IPC (Feather v2)
+instead of CSV. Every format goes through the schemas below, and only the
+columns the dashboard actually uses are loaded.
+
+Convert the existing CSV exports once (and again after each new export):
+
+    python convert_to_columnar.py                  # Parquet (default)
+    python convert_to_columnar.py --format arrow   # Arrow IPC
+"""
+
+import argparse
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# -----------------------------------------------------------
+# SCHEMAS (column -> dtype, None keeps the stored type, e.g. ids)
+# -----------------------------------------------------------
+
+ORDERS_SCHEMA = {
+    "order_id": None,
+    "order_timestamp": "datetime64[ns]",
+    "customer_hash_id": None,
+    "total": "float64",
+    "category": "category",
+}
+
+ITEMS_SCHEMA = {
+    "order_id": None,
+    "order_timestamp": "datetime64[ns]",
+    "product_name": "category",
+    "vendor_name": "category",
+    "category": "category",
+    "net_sales": "float64",
+    "total_inventory_sold": "int64",
+}
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def source_path(stem, fmt):
+    """File name for a source table in the given format ("csv", "parquet", "arrow")."""
+    return stem + EXTENSIONS[fmt]
+
+
+def _projected(names, schema):
+    return [c for c in schema if c in names]
+
+
+def apply_schema(frame, schema):
+    """Cast projected columns to their schema dtype (no-op when already typed)."""
+    for col, dtype in schema.items():
+        if dtype is None or col not in frame.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            if not pd.api.types.is_datetime64_any_dtype(frame[col]):
+                frame[col] = pd.to_datetime(frame[col])
+        elif str(frame[col].dtype) != dtype:
+            frame[col] = frame[col].astype(dtype)
+    return frame
+
+
+def read_csv_typed(path, schema):
+    """Read a CSV with column projection and explicit dtypes (no inference)."""
+    return read_csv_tail(path, schema)[0]
+
+
+def read_csv_tail(path, schema, offset=0):
+    """
+    Parse a CSV from byte `offset` onward (0 = whole file, header included).
+    Returns the typed frame and the offset just past the last parsed line,
+    so a file that is appended to can be resumed from there without
+    re-reading what was already parsed. A full read parses to the end of
+    the file; a tail read leaves a partial last line for next time.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    columns = _projected(header, schema)
+    dates = [c for c in columns if (schema[c] or "").startswith("datetime64")]
+    dtypes = {c: schema[c] for c in columns if schema[c] and c not in dates}
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    if offset:
+        # A writer may be mid-line; leave the partial last line for next time
+        data = data[: data.rfind(b"\n") + 1]
+    if offset and not data:
+        return apply_schema(pd.DataFrame(columns=columns), schema), offset
+
+    frame = pd.read_csv(
+        io.BytesIO(data),
+        header=0 if offset == 0 else None,
+        names=None if offset == 0 else list(header),
+        usecols=columns,
+        dtype=dtypes,
+        parse_dates=dates,
+    )
+    return apply_schema(frame, schema), offset + len(data)
+
+
+def read_table(path, schema):
+    """Load one source table from CSV, Parquet or Arrow IPC, projected to `schema`."""
+    ext = os.path.splitext(path)[1]
+
+    if ext == EXTENSIONS["csv"]:
+        return read_csv_typed(path, schema)
+
+    if ext == EXTENSIONS["parquet"]:
+        columns = _projected(pq.read_schema(path).names, schema)
+        frame = pd.read_parquet(path, columns=columns)
+    elif ext == EXTENSIONS["arrow"]:
+        with pa.memory_map(path) as source:
+            names = pa.ipc.open_file(source).schema.names
+        frame = pd.read_feather(path, columns=_projected(names, schema))
+    else:
+        raise ValueError(f"Unsupported source format: {path}")
+
+    return apply_schema(frame, schema)
+
+
+# -----------------------------------------------------------
+# CSV -> PARQUET / ARROW CONVERTER
+# -----------------------------------------------------------
+
+
+def convert(csv_path, schema, fmt):
+    frame = read_csv_typed(csv_path, schema)
+    out_path = source_path(os.path.splitext(csv_path)[0], fmt)
+    if fmt == "parquet":
+        frame.to_parquet(out_path, index=False)
+    else:
+        # Uncompressed Arrow IPC can be memory-mapped directly
+        frame.to_feather(out_path, compression="uncompressed")
+    return out_path, len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    parser.add_argument("--orders", default="orders_clean.csv")
+    parser.add_argument("--items", default="items_clean.csv")
+    args = parser.parse_args()
+
+    for csv_path, schema in ((args.orders, ORDERS_SCHEMA), (args.items, ITEMS_SCHEMA)):
+        out_path, rows = convert(csv_path, schema, args.format)
+        size_mb = os.path.getsize(out_path) / 1e6
+        print(f"{csv_path} -> {out_path} ({rows:,} rows, {size_mb:,.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()